@@ -1,7 +1,8 @@
 '''
  AUTHOR: Gabriel Bassett
  DATE: 07-11-2013
- DEPENDANCIES: uuid, py2neo
+ DEPENDANCIES: uuid, py2neo, pandas (for planAttributes and inferTypes),
+  dateutil (for "datetime" columnTypes)
  Copyright 2013 Gabriel Bassett
 
  LICENSE:
@@ -31,6 +32,18 @@
 from py2neo import neo4j, cypher
 #import networkx as nx
 import csv
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+from contextlib import contextmanager
+import argparse
+import multiprocessing
+import threading
+import Queue
+from collections import OrderedDict
 from datetime import datetime # used to calculate times
 import logging
 
@@ -46,6 +59,10 @@ import_list = [0,1,2]
 # Establish the list of attribute names from the CSV file:
 #  Current values are for example only and should be replaced
 attributes = ["IP", "nb_name", "mac_address", "start_time", "os_name"]
+# Types to store attributes as by name: "int", "float", "datetime" (stored as
+#  a UTC ISO 8601 string) or "string", e.g. {"start_time": "datetime"}.
+#  Unlisted attributes are stored as strings unless inferTypes is set.
+columnTypes = {}
 # Set a relationship type between row anchor nodes and parents
 #  Current value is for example only and should be replaced
 parentRelationshipType = "has_child"
@@ -53,6 +70,84 @@ parentRelationshipType = "has_child"
 startRow = 0
 # If the first row is column headers, set to true.
 columnHeaders = True
+# Number of rows to send to the database together in one transactional batch.
+#  Set to 0 or 1 to import a row at a time.
+batchSize = 0
+# Number of times to retry a batch that failed and was rolled back
+batchRetries = 3
+# Maximum number of node IDs to remember so repeated attribute and parent
+#  lookups skip the database.  Set to 0 to disable the cache.
+cacheSize = 100000
+# Approximate memory cap for the node cache in megabytes
+cacheMemory = 64
+# Look nodes up through a legacy index per attribute name (attribute,
+#  row_number, file) instead of scanning every node.  Nodes created before
+#  index mode was turned on are not in the indexes.
+useIndex = False
+# Number of processes to split the csv file between.  Can also be set with
+#  --workers.  The file is split between workers at line breaks, so rows with
+#  quoted newlines are not supported with more than 1.
+workers = 1
+# Where to save progress so an import can be restarted with --resume.  One
+#  file per worker is written with a ".<worker number>" suffix.
+checkpointFile = "csv_import.checkpoint"
+# Number of rows between checkpoints when not using batches.  In batch mode a
+#  checkpoint is written after every committed batch.
+checkpointInterval = 1000
+# Continue from the last checkpoint instead of startRow.  Can also be set
+#  with --resume.
+resume = False
+# Directory to write bulk-load node and relationship csv files to instead of
+#  importing into the database.  None to import into the database.  Can also be
+#  set with --offline.
+offlineDir = None
+# Number of parent relationships to new row anchors to create together
+parentBatchSize = 100
+# Find every attribute value with pandas and create the attribute nodes before
+#  importing, so rows only need their relationships created.  Can also be set
+#  with --plan.  Needs enough memory to hold each column's unique values.
+planAttributes = False
+# Number of csv rows read at a time while planning
+planChunkSize = 100000
+# Number of attribute nodes looked up or created per batch while planning
+planBatchSize = 1000
+# Where to keep every node ID seen, behind the node cache, so lookups stay
+#  local without holding them all in memory.  None keeps only the node cache,
+#  "memory" keeps them in a dict, "sqlite" or "dbm" keep them on disk at
+#  dedupePath.  Delete dedupePath if the database is cleared.  "dbm" can't be
+#  used with more than 1 worker.  Bulk-load files get their own store in
+#  offlineDir.
+dedupeStore = None
+dedupePath = "csv_import.dedupe"
+# File to append per-stage timings to as JSON lines.  None to not record
+#  them.  Can also be set with --stats.
+statsFile = None
+# Seconds between lines in the stats file
+statsInterval = 10
+# Number of rows to have waiting on the database at once, each on its own
+#  thread.  Rows touching the same node or relationship wait for each other.
+#  Set to 0 or 1 to import a row at a time.  Not used in batch mode.  Can also
+#  be set with --pipeline.
+pipelineDepth = 0
+# File to remember a hash of each row's contents in, by row_key, so rows that
+#  haven't changed since the last import are skipped.  Relationships from
+#  the old version of a changed row are left in place.  None to import every
+#  row.  Can also be set with --fingerprints.
+fingerprintFile = None
+# Keep running and import rows as they're appended to CSV_FILE, or, if
+#  CSV_FILE is a directory, as files matching followPattern appear in it.
+#  Can also be set with --follow.
+follow = False
+followPattern = "*.csv"
+# Seconds to wait between checks for new rows
+followInterval = 5
+# Most new rows imported together in one batch while following.  batchSize
+#  is used if it's larger.
+followBatchSize = 1000
+# Infer the types of attributes not in columnTypes from the first inferRows
+#  rows with pandas.  Not done when following.
+inferTypes = False
+inferRows = 1000
 ##
 
 ## SETUP
@@ -61,10 +156,374 @@ G = neo4j.GraphDatabaseService(NEODB)
 # Logging Setup
 FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
 logging.basicConfig(format=FORMAT, level=logging.ERROR)
+# The batch currently being collected.  None when importing a row at a time.
+_plan = None
+# Shared state between worker processes.  None when importing in one process.
+_coordinator = None
+# Bulk-load file writer.  None when importing into the database.
+_offline = None
+# Parent nodes remembered by get_parent
+_parents = {}
+# (parent, anchor) relationships waiting to be created together
+_parentEdges = []
+# Row fingerprints.  None when importing every row.
+fingerprints = None
+# Functions converting cells to their column's type, by column name
+columnConverters = {}
+# Per-thread state for the row being imported.  _row.created holds the IDs of
+#  nodes created while importing it.
+_row = threading.local()
 
 
 
 ## EXECUTION
+class NodeCache(object):
+    """ A least recently used cache from attr_key to node ID, bounded by both
+        number of entries and approximate memory use.
+
+    """
+    # rough per-entry overhead of the OrderedDict in bytes
+    OVERHEAD = 100
+
+    def __init__(self, size, memory):
+        self.size = size
+        self.memory = memory * 1024 * 1024
+        self.data = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def sizeof(self, key):
+        """ tuple -> int
+
+            Takes a cache key and returns its approximate size in bytes.
+        """
+        b = sys.getsizeof(key) + self.OVERHEAD
+        for k, v in key:
+            b += sys.getsizeof(k) + sys.getsizeof(v)
+        return b
+
+    def get(self, key):
+        """ tuple -> int or None
+
+            Takes a cache key and returns the cached node ID or None.
+        """
+        nid = self.data.pop(key, None)
+        if nid is None:
+            self.misses += 1
+            return None
+        # reinsert to mark as most recently used
+        self.data[key] = nid
+        self.hits += 1
+        return nid
+
+    def put(self, key, nid):
+        """ tuple, int -> NoneType
+
+            Takes a cache key and node ID and caches it, evicting the least
+             recently used entries if the cache is over either limit.
+        """
+        if self.size <= 0:
+            return
+        if key in self.data:
+            del self.data[key]
+        else:
+            self.bytes += self.sizeof(key)
+        self.data[key] = nid
+        while len(self.data) > self.size or self.bytes > self.memory:
+            k, v = self.data.popitem(last=False)
+            self.bytes -= self.sizeof(k)
+            self.evictions += 1
+
+    def __str__(self):
+        return "{0} hits, {1} misses, {2} evictions, {3} entries, ~{4}KB".format(
+            self.hits, self.misses, self.evictions, len(self.data), self.bytes / 1024)
+
+
+# Cache of previously seen nodes
+nodeCache = NodeCache(cacheSize, cacheMemory)
+
+
+def store_key(key):
+    """ tuple -> str
+
+        Takes an attr_key and returns it as a string for on-disk stores.
+    """
+    return json.dumps(key, separators=(',', ':'))
+
+
+class MemoryStore(object):
+    """ A dedupe store from attr_key to node ID kept in a dict.
+
+    """
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def put(self, key, nid):
+        self.data[key] = nid
+
+    def close(self):
+        pass
+
+
+class SqliteStore(object):
+    """ A dedupe store from attr_key to node ID kept in a sqlite database.
+        Each put is committed on its own and the database is in WAL mode, so
+        workers sharing the file never wait on each other's writes for long.
+
+    """
+    def __init__(self, path):
+        import sqlite3
+        # access is serialized by TieredStore's lock
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.execute("CREATE TABLE IF NOT EXISTS nodes (key TEXT PRIMARY KEY, id INTEGER)")
+
+    def get(self, key):
+        r = self.db.execute("SELECT id FROM nodes WHERE key = ?",
+                            (store_key(key),)).fetchone()
+        if r is None:
+            return None
+        return r[0]
+
+    def put(self, key, nid):
+        self.db.execute("INSERT OR REPLACE INTO nodes VALUES (?, ?)",
+                        (store_key(key), nid))
+
+    def close(self):
+        self.db.close()
+
+
+class DbmStore(object):
+    """ A dedupe store from attr_key to node ID kept in a dbm file.
+
+    """
+    def __init__(self, path):
+        import anydbm
+        self.db = anydbm.open(path, 'c')
+
+    def get(self, key):
+        nid = self.db.get(store_key(key))
+        if nid is None:
+            return None
+        return int(nid)
+
+    def put(self, key, nid):
+        self.db[store_key(key)] = str(nid)
+
+    def close(self):
+        self.db.close()
+
+
+def open_store(kind, path, fresh=False):
+    """ str, str, bool -> dedupe store or None
+
+        Takes the kind of dedupe store, where to keep it, and whether to start
+         it empty.  Returns the store, or None if kind is None.
+
+    """
+    if kind is None:
+        return None
+    if kind == "memory":
+        return MemoryStore()
+    if fresh:
+        for p in glob.glob(path + "*"):
+            os.remove(p)
+    if kind == "sqlite":
+        return SqliteStore(path)
+    if kind == "dbm":
+        return DbmStore(path)
+    raise ValueError("Unknown dedupe store {0}".format(kind))
+
+
+class TieredStore(object):
+    """ A node cache in front of an optional dedupe store.  Lookups that miss
+        the cache go to the store and are cached.
+
+    """
+    def __init__(self, front, back=None):
+        self.front = front
+        self.back = back
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            nid = self.front.get(key)
+            if nid is None and self.back is not None:
+                nid = self.back.get(key)
+                if nid is not None:
+                    self.front.put(key, nid)
+            return nid
+
+    def put(self, key, nid):
+        with self.lock:
+            self.front.put(key, nid)
+            if self.back is not None:
+                self.back.put(key, nid)
+
+    def close(self):
+        if self.back is not None:
+            self.back.close()
+
+
+# Node IDs known locally.  The dedupe store is opened by main().
+nodeStore = TieredStore(nodeCache)
+
+
+class StageStats(object):
+    """ Times each stage of the import and counts database round trips.  Every
+        interval seconds a JSON line is appended to the stats file with the
+        rows/sec, round trips per row, and count, total, p50 and p99 seconds
+        for each stage.  Stage times include any stages nested inside them.
+
+    """
+    def __init__(self, path=None, interval=10):
+        self.path = path
+        self.interval = interval
+        self.worker = 0
+        self.reset()
+
+    def reset(self):
+        self.times = {} # stage -> list of seconds
+        self.rows = 0
+        self.trips = 0
+        self.start = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        """ str -> context manager
+
+            Takes a stage name and times the block run under it.
+        """
+        t = time.time()
+        try:
+            yield
+        finally:
+            self.times.setdefault(name, []).append(time.time() - t)
+
+    def round_trip(self, n=1):
+        self.trips += n
+
+    def row(self):
+        """ Counts a row and writes the stats if the interval has passed. """
+        self.rows += 1
+        if time.time() - self.start >= self.interval:
+            self.emit()
+
+    def emit(self):
+        """ Writes the stats for the current interval and starts a new one. """
+        if self.path is None:
+            self.reset()
+            return
+
+        elapsed = max(time.time() - self.start, 1e-9)
+        stages = {}
+        for name, times in self.times.items():
+            times.sort()
+            stages[name] = {"count": len(times),
+                            "total": sum(times),
+                            "p50": times[int(0.50 * (len(times) - 1))],
+                            "p99": times[int(0.99 * (len(times) - 1))]}
+        line = {"time": datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'),
+                "worker": self.worker,
+                "rows": self.rows,
+                "rows_per_sec": self.rows / elapsed,
+                "round_trips_per_row": float(self.trips) / max(self.rows, 1),
+                "stages": stages}
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(line) + "\n")
+        self.reset()
+
+
+# Import timings
+stats = StageStats(statsFile, statsInterval)
+
+
+def attr_key(attr):
+    """ dict -> tuple
+
+    Takes a dict of node properties and returns a hashable, canonical key for it.
+
+    """
+    return tuple(sorted(attr.items()))
+
+
+# Node indexes by name, created as needed
+_indexes = {}
+
+
+def get_index(name):
+    """ str -> py2neo index object
+
+    Takes an index name and returns the node index, creating it if needed.
+
+    """
+    global G
+
+    if name not in _indexes:
+        _indexes[name] = G.get_or_create_index(neo4j.Node, name)
+    return _indexes[name]
+
+
+def index_key(attr):
+    """ dict -> (str, str, value) or None
+
+    Takes a dict of node properties and returns the index name, key, and value
+     the node is indexed under, or None if the node isn't indexable.
+     Attribute nodes are indexed in the "attribute" index under their attribute
+     name.  Nodes with a single property are indexed under that property.
+
+    """
+    if "attribute" in attr and attr["attribute"] in attr:
+        key = attr["attribute"]
+        return "attribute", key, attr[key]
+    if len(attr) == 1:
+        key = attr.keys()[0]
+        return key, key, attr[key]
+    return None
+
+
+def node_query(attr, match = ""):
+    """ dict, str -> str
+
+    Takes a dict of node properties and an optional cypher match statement and
+     returns the query used to look up a node with those properties.  The
+     properties are passed to the query as parameters.  In index mode the
+     lookup goes through the node's index.
+
+    """
+    ik = index_key(attr) if useIndex else None
+    if ik is not None:
+        return "START n=node:{0}(`{1}`={2}) {3} RETURN n;".format(
+                                       ik[0], ik[1], "{"+ik[1]+"}", match)
+
+    s = ""
+    for key in attr:
+        s = s + "n.{0}! = {1} AND ".format(key, "{"+key+"}")
+    s = s.rstrip("AND ")
+    return "START n=node(*) " + match + " WHERE " + s + " RETURN n;"
+
+
+def edge_query(relationship, attr = {}):
+    """ hashable_obj, dict -> str
+
+    Takes a relationship type and a dict of relationship properties and returns
+     the query used to look up the relationship between {sourceID} and {targetID}.
+
+    """
+    s = ""
+    for key in attr:
+        s = s + " AND n.{0}! = {1} ".format(key, "{"+key+"}")
+    return "START n=node(*) MATCH n-[r:{0}]->m WHERE ID(n) = {1} AND ID(m) = {2} {3} RETURN r;".format(
+                                                                relationship, "{sourceID}", "{targetID}", s)
+
+
 def get_or_create_node(attr, match = ""):
     """ (dict of propertiy key:value pairs), str -> py2neo node object, bool
 
@@ -77,23 +536,69 @@ def get_or_create_node(attr, match = ""):
 
     """
     global G
-    
+
+    # If a batch is being collected, defer the lookup to the batch
+    if _plan is not None:
+        return _plan.node(attr), False
+
+    # If writing bulk-load files, there's no database to look in
+    if _offline is not None:
+        return _offline.get_or_create_node(attr)
+
+    # Check the cache and dedupe store
+    key = attr_key(attr)
+    nid = nodeStore.get(key)
+    if nid is not None:
+        return G.node(nid), True
+
+    # With multiple workers, hold the key's lock so only one creates the node.
+    #  The dedupe store can be shared too, so it's only written to once the
+    #  lock is released.
+    if _coordinator is not None:
+        with _coordinator.lock(key):
+            d, b = lookup_node(attr, match)
+    else:
+        d, b = lookup_node(attr, match)
+
+    nodeStore.put(key, d._id)
+    created = getattr(_row, "created", None)
+    if not b and created is not None:
+        created.add(d._id)
+
+    return d, b
+
+
+def lookup_node(attr, match = ""):
+    """ dict, str -> py2neo node object, bool
+
+    Takes a dict of node properties and a cypher match statement and queries
+     the database for the node, creating it if it isn't found.  Returns the
+     node and True if the node previously existed.
+
+    """
+    global G
+
     # Build the query string
-    s = ""
-    for key in attr:
-        s = s + "n.{0}! = {1} AND ".format(key, "{"+key+"}")
-    s = s.rstrip("AND ")
-    matchQuery = "START n=node(*) " + match + " WHERE " + s + " RETURN n;"
-    query = "START n=node(*) WHERE " + s + " RETURN n;"
-    try:
-        data, metadata = cypher.execute(G, query, attr)
-    except Exception:
-        data, metadata = cypher.execute(G, matchQuery, attr)
+    matchQuery = node_query(attr, match)
+    query = node_query(attr)
+    with stats.stage("node_lookup"):
+        try:
+            stats.round_trip()
+            data, metadata = cypher.execute(G, query, attr)
+        except Exception:
+            stats.round_trip()
+            data, metadata = cypher.execute(G, matchQuery, attr)
         
     # If the query is empty
     if len(data) == 0:
         # create node with the IP
-        d, = G.create(attr)
+        ik = index_key(attr) if useIndex else None
+        with stats.stage("node_create"):
+            stats.round_trip()
+            if ik is not None:
+                d = get_index(ik[0]).get_or_create(ik[1], ik[2], attr)
+            else:
+                d, = G.create(attr)
         b = False
     # If the query has something
     else:
@@ -113,24 +618,50 @@ def get_or_create_edge(source, target, relationship, attr = {}):
     """
     global G
 
+    # If a batch is being collected, defer the check to the batch
+    if _plan is not None:
+        return _plan.edge(source, target, relationship, attr), False
+
+    if _offline is not None:
+        return _offline.get_or_create_edge(source, target, relationship, attr)
+
+    # With multiple workers, hold the edge's lock so only one creates it
+    if _coordinator is not None:
+        key = (source._id, target._id, relationship, attr_key(attr))
+        with _coordinator.lock(key):
+            return lookup_edge(source, target, relationship, attr)
+
+    return lookup_edge(source, target, relationship, attr)
+
+
+def lookup_edge(source, target, relationship, attr = {}):
+    """ (py2neo node object, py2neo node obj, hashable_obj, dict) -> py2neo edge object, bool
+
+    Takes a source node, target node, relationship type and properties and
+     queries the database for the relationship, creating it if it isn't found.
+     Returns the relationship and True if it previously existed.
+
+    """
+    global G
+
     # Check for edge
-    s = ""
-    for key in attr:
-        s = s + " AND n.{0}! = {1} ".format(key, "{"+key+"}")
-    query = "START n=node(*) MATCH n-[r:{0}]->m WHERE ID(n) = {1} AND ID(m) = {2} {3} RETURN r;".format(
-                                                                relationship, "{sourceID}", "{targetID}", s)
+    query = edge_query(relationship, attr)
     params = attr.copy()
     params["sourceID"] = source._id
     params["targetID"] = target._id
 
-    data, metadata = cypher.execute(G, query, params)        
+    with stats.stage("edge_check"):
+        stats.round_trip()
+        data, metadata = cypher.execute(G, query, params)        
 
     # If the relationship doesn't exist
     if len(data) == 0:
-        # Create a relationship from the node to the exporter
-        r, = G.create((source, relationship ,target))
-        # Add attributes
-        r.update_properties(attr)
+        with stats.stage("edge_create"):
+            # Create a relationship from the node to the exporter
+            stats.round_trip(2)
+            r, = G.create((source, relationship ,target))
+            # Add attributes
+            r.update_properties(attr)
         b = False
     else:
         r = data[0][0]
@@ -139,6 +670,372 @@ def get_or_create_edge(source, target, relationship, attr = {}):
     return r, b
 
 
+def create_edge(source, target, relationship):
+    """ (py2neo node object, py2neo node obj, hashable_obj) -> NoneType
+
+    Takes a source node, target node, and relationship type and creates the
+    relationship without checking if it already exists.
+
+    """
+    global G
+
+    if _plan is not None:
+        _plan.edge(source, target, relationship)
+    elif _offline is not None:
+        _offline.get_or_create_edge(source, target, relationship)
+    else:
+        with stats.stage("edge_create"):
+            stats.round_trip()
+            G.create((source, relationship, target))
+
+
+class PlannedNode(object):
+    """ A node in a BatchPlan.  Stands in for a py2neo node object until the
+        batch is sent to the database.
+
+    """
+    def __init__(self, pos):
+        self.pos = pos
+
+    def __eq__(self, other):
+        return isinstance(other, PlannedNode) and self.pos == other.pos
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.pos)
+
+
+class BatchPlan(object):
+    """ Collects the node and relationship lookups and creates for a batch of
+        rows so they can be sent to the database together.
+
+    """
+    def __init__(self):
+        self.nodes = [] # attr dicts in the order first seen, None if existing
+        self.nodeIndex = {} # attr_key or node ID -> position in self.nodes
+        self.existing = {} # position -> py2neo node already in the database
+        self.edges = [] # (source pos, target pos, relationship, attr)
+        self.edgeIndex = set()
+        # parents remembered by get_parent for this batch, starting with the
+        #  ones earlier batches created
+        self.parents = dict(_parents)
+
+    def node(self, attr):
+        """ dict -> PlannedNode
+
+            Takes a dict of node properties and returns the planned node for it.
+        """
+        key = attr_key(attr)
+        if key not in self.nodeIndex:
+            self.nodeIndex[key] = len(self.nodes)
+            self.nodes.append(attr.copy())
+        return PlannedNode(self.nodeIndex[key])
+
+    def pos(self, node):
+        """ PlannedNode or py2neo node object -> int
+
+            Takes a planned node or a node already in the database and returns
+             its position in the plan.
+        """
+        if isinstance(node, PlannedNode):
+            return node.pos
+        if node._id not in self.nodeIndex:
+            self.nodeIndex[node._id] = len(self.nodes)
+            self.existing[len(self.nodes)] = node
+            self.nodes.append(None)
+        return self.nodeIndex[node._id]
+
+    def edge(self, source, target, relationship, attr = {}):
+        """ node, node, hashable_obj, dict -> tuple
+
+            Takes a source, target (planned or already in the database),
+             relationship type and properties and adds the relationship to the
+             plan.  Returns the planned relationship.
+        """
+        e = (self.pos(source), self.pos(target), relationship, attr_key(attr))
+        if e not in self.edgeIndex:
+            self.edgeIndex.add(e)
+            self.edges.append((e[0], e[1], relationship, dict(attr)))
+        return e
+
+
+class OfflineNode(object):
+    """ A node written to a bulk-load file.  Stands in for a py2neo node object.
+
+    """
+    def __init__(self, nid):
+        self._id = nid
+
+
+class OfflineGraph(object):
+    """ Stands in for the database when writing bulk-load files.  Nodes and
+        relationships are deduplicated, given sequential integer IDs, and
+        streamed to nodes.csv and relationships.csv in the format of the
+        neo4j-import tool.  Like a new row anchor online, a relationship to or
+        from a node created in the same row can't already exist, so it isn't
+        checked or remembered.  If create_row_anchor reuses anchors between
+        rows, their relationships can be written more than once.
+
+    """
+    def __init__(self, directory, columns):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # attr_key -> node ID.  Always needs a complete store, kept apart from
+        #  the database's dedupe store.
+        back = open_store(dedupeStore or "memory",
+                          os.path.join(directory, "dedupe"), fresh=True)
+        if isinstance(back, MemoryStore):
+            # a cache in front of a dict would only double the memory
+            self.nodes = back
+        else:
+            self.nodes = TieredStore(NodeCache(cacheSize, cacheMemory), back)
+        self.count = 0
+        self.edges = set() # (source ID, target ID, type) between older nodes
+        self.edgeCount = 0
+
+        # Every node property needs a column
+        self.properties = []
+        for p in ["Class", "attribute", "row_number", "file"] + list(columns):
+            if p not in self.properties:
+                self.properties.append(p)
+        types = {"row_number": ":int"}
+        for p, conv in columnConverters.items():
+            if conv is int:
+                types[p] = ":int"
+            elif conv is float:
+                types[p] = ":float"
+        header = ["id:ID"] + [p + types.get(p, "") for p in self.properties]
+
+        self.nodeFile = open(os.path.join(directory, "nodes.csv"), 'wb')
+        self.nodeWriter = csv.writer(self.nodeFile)
+        self.nodeWriter.writerow(header)
+        self.edgeFile = open(os.path.join(directory, "relationships.csv"), 'wb')
+        self.edgeWriter = csv.writer(self.edgeFile)
+        self.edgeWriter.writerow([":START_ID", ":END_ID", ":TYPE"])
+
+    def get_or_create_node(self, attr):
+        """ dict -> OfflineNode, bool
+
+            Takes a dict of node properties and returns the node and True if it
+             had already been written.
+        """
+        key = attr_key(attr)
+        nid = self.nodes.get(key)
+        if nid is not None:
+            return OfflineNode(nid), True
+
+        for p in attr:
+            if p not in self.properties:
+                raise ValueError("Node property {0} has no column in nodes.csv".format(p))
+        nid = self.count
+        self.count += 1
+        self.nodes.put(key, nid)
+        self.nodeWriter.writerow([nid] + [attr.get(p, "") for p in self.properties])
+        created = getattr(_row, "created", None)
+        if created is not None:
+            created.add(nid)
+        return OfflineNode(nid), False
+
+    def get_or_create_edge(self, source, target, relationship, attr = {}):
+        """ OfflineNode, OfflineNode, hashable_obj, dict -> tuple, bool
+
+            Takes a source, target, and relationship type and returns the
+             relationship and True if it had already been written.
+             Relationship properties are not supported.
+        """
+        if attr:
+            raise ValueError("Relationship properties are not supported offline")
+        e = (source._id, target._id, relationship)
+        created = getattr(_row, "created", ())
+        if source._id not in created and target._id not in created:
+            if e in self.edges:
+                return e, True
+            self.edges.add(e)
+        self.edgeCount += 1
+        self.edgeWriter.writerow(list(e))
+        return e, False
+
+    def close(self):
+        self.nodeFile.close()
+        self.edgeFile.close()
+        self.nodes.close()
+
+    def __str__(self):
+        return "{0} nodes, {1} relationships".format(self.count, self.edgeCount)
+
+
+def first_result(result):
+    """ batch result -> py2neo object or None
+
+        Takes the result of a cypher query submitted in a batch and returns the
+         first value of the first row, or None if there were no rows.
+
+    """
+    while isinstance(result, list):
+        if len(result) == 0:
+            return None
+        result = result[0]
+    return result
+
+
+def submit_plan(plan):
+    """ BatchPlan -> list of ints
+
+        Takes a BatchPlan and sends it to the database in three round trips:
+         a batch of node lookups, a batch of relationship lookups between nodes
+         that already exist, and a write batch creating everything missing.
+         The server runs each batch in a single transaction so a failed write
+         batch leaves nothing behind.  Returns the node IDs in plan order.
+
+    """
+    global G
+
+    # Look up every node in the plan that isn't cached
+    found = [None] * len(plan.nodes)
+    lookup = []
+    batch = neo4j.WriteBatch(G)
+    for pos, attr in enumerate(plan.nodes):
+        if attr is None:
+            found[pos] = plan.existing[pos]
+            continue
+        nid = nodeStore.get(attr_key(attr))
+        if nid is not None:
+            found[pos] = G.node(nid)
+        else:
+            batch.append_cypher(node_query(attr), attr)
+            lookup.append(pos)
+    if lookup:
+        with stats.stage("batch_node_lookup"):
+            stats.round_trip()
+            results = batch.submit()
+        for pos, r in zip(lookup, results):
+            found[pos] = first_result(r)
+
+    # Look up relationships where both ends already exist
+    batch = neo4j.WriteBatch(G)
+    checked = []
+    for e in plan.edges:
+        source, target = found[e[0]], found[e[1]]
+        if source is not None and target is not None:
+            params = e[3].copy()
+            params["sourceID"] = source._id
+            params["targetID"] = target._id
+            batch.append_cypher(edge_query(e[2], e[3]), params)
+            checked.append(e)
+    exists = set()
+    if checked:
+        with stats.stage("batch_edge_check"):
+            stats.round_trip()
+            results = batch.submit()
+        for e, r in zip(checked, results):
+            if first_result(r) is not None:
+                exists.add(e[:3])
+
+    # Create the missing nodes and relationships.  New nodes are referred to by
+    #  their position in the write batch.
+    batch = neo4j.WriteBatch(G)
+    refs = list(found)
+    count = 0
+    for pos, attr in enumerate(plan.nodes):
+        if refs[pos] is None:
+            refs[pos] = count
+            ik = index_key(attr) if useIndex else None
+            if ik is not None:
+                batch.get_or_create_indexed_node(get_index(ik[0]), ik[1], ik[2], attr)
+            else:
+                batch.create(attr)
+            count += 1
+    for e in plan.edges:
+        if e[:3] not in exists:
+            batch.create((refs[e[0]], e[2], refs[e[1]], e[3]))
+            count += 1
+    results = []
+    if count:
+        with stats.stage("batch_write"):
+            stats.round_trip()
+            results = batch.submit()
+
+    # Only cache the nodes once the write batch has been committed
+    ids = []
+    for pos, attr in enumerate(plan.nodes):
+        if found[pos] is not None:
+            ids.append(found[pos]._id)
+        else:
+            ids.append(results[refs[pos]]._id)
+        if attr is not None:
+            nodeStore.put(attr_key(attr), ids[-1])
+
+    return ids
+
+
+def import_batch(rows, attributes):
+    """ list of (list, int) tuples, list -> NoneType
+
+        Takes a list of (csv row, line number) tuples and the column names.
+         Collects the rows into a BatchPlan and submits it, retrying the whole
+         batch up to batchRetries times if it fails.
+
+    """
+    global _plan
+
+    _plan = BatchPlan()
+    try:
+        for row, line_num in rows:
+            import_row(row, line_num, attributes)
+        plan = _plan
+    finally:
+        _plan = None
+
+    for attempt in range(batchRetries + 1):
+        try:
+            ids = submit_plan(plan)
+            break
+        except Exception as e:
+            logging.error("Batch ending at line {0} failed (attempt {1}): {2}".format(
+                                                   rows[-1][1], attempt + 1, e))
+            if attempt == batchRetries:
+                raise
+
+    # remember parents the batch planned as real nodes, so later batches
+    #  (and later polls of a followed file) don't plan them again
+    for k, n in plan.parents.items():
+        if isinstance(n, PlannedNode):
+            _parents[k] = G.node(ids[n.pos])
+
+
+def parent_memo():
+    """ NoneType -> dict
+
+        Returns the dict get_parent remembers parent nodes in.  Planned nodes
+         are only valid within their batch so each batch gets its own, starting
+         with the parents earlier batches created.
+
+    """
+    if _plan is not None:
+        return _plan.parents
+    return _parents
+
+
+def flush_parent_edges():
+    """ NoneType -> NoneType
+
+        Creates the waiting parent relationships in one batch.
+
+    """
+    global G, _parentEdges
+
+    if _parentEdges:
+        batch = neo4j.WriteBatch(G)
+        for parentNode, hostNode in _parentEdges:
+            batch.create((parentNode, parentRelationshipType, hostNode))
+        with stats.stage("edge_create"):
+            stats.round_trip()
+            batch.submit()
+        _parentEdges = []
+
+
 def create_row_anchor(r, *args, **xargs):
     """ list -> py2neo node object
 
@@ -154,6 +1051,21 @@ def create_row_anchor(r, *args, **xargs):
     return n
 
 
+def row_key(r, *args, **xargs):
+    """ list -> hashable_obj
+
+        Takes a list representing the row of a csv file.  Returns a key that
+         identifies the row's anchor from one import to the next.  Used to skip
+         unchanged rows.
+
+        In the example code, the row number is used as the anchor node.
+
+    """
+    ### REPLACE WITH YOUR OWN CODE ###
+    return args[0]
+    ### REPLACE WITH YOUR OWN CODE ###
+
+
 def get_parent(n, r, *args, **xargs):
     """ py2neo node object, list -> py2neo node object
 
@@ -164,73 +1076,851 @@ def get_parent(n, r, *args, **xargs):
          
     """
     ### REPLACE WITH YOUR OWN CODE ###
-    filename = CSV_FILE.split("/")
-    filename = filename[len(filename) - 1]
-    filename = CSV_FILE.split("\\")
-    filename = filename[len(filename) - 1]
-    n, b = get_or_create_node({"file": filename})
+    # The parent is the same for every row in the file so only look it up once
+    memo = parent_memo()
+    if CSV_FILE not in memo:
+        filename = CSV_FILE.replace("\\", "/").split("/")[-1]
+        memo[CSV_FILE], b = get_or_create_node({"file": filename})
+    n = memo[CSV_FILE]
     ### REPLACE WITH YOUR OWN CODE ###
 
     return n
                         
 
-def main():
-    global startRow
-  
-    # open csv
+def plan_attributes(columns, start):
+    """ list, int -> int
+
+        Takes the column names and the byte offset of the first row to import.
+         Reads the rest of the csv file in chunks with pandas and finds the
+         unique values of each column in import_list.  The attribute nodes for
+         them are then looked up or created in batches and their IDs kept in
+         nodeStore, which needs a dedupe store so they aren't evicted.
+         Returns the number of attribute nodes.
+
+    """
+    try:
+        import pandas as pd
+    except ImportError:
+        raise ImportError("Planning attributes requires pandas")
+
+    # Find the unique values of each column
+    uniques = dict((c, set()) for c in import_list)
     with open(CSV_FILE, 'rb') as f:
-        # if there are column headers, read them
-        if columnHeaders:
-            f.seek(0)
-            linereader = csv.reader(f, delimiter=',', quotechar='\"')
-            attributes = linereader.next()
-            if startRow is not 0:
+        f.seek(start)
+        chunks = pd.read_csv(f, header=None, usecols=import_list, dtype=str,
+                             keep_default_na=False, quotechar='\"',
+                             chunksize=planChunkSize)
+        for chunk in chunks:
+            for c in import_list:
+                uniques[c].update(chunk[c].unique())
+
+    # Get or create the attribute nodes
+    attrs = []
+    for c in import_list:
+        for value in uniques[c]:
+            if value:
+                attrs.append({"Class":"attribute",
+                              "attribute":columns[c],
+                              columns[c]:coerce(columns[c], value)})
+    del uniques
+    for i in range(0, len(attrs), planBatchSize):
+        plan = BatchPlan()
+        for attr in attrs[i:i + planBatchSize]:
+            plan.node(attr)
+        submit_plan(plan)
+
+    return len(attrs)
+
+
+def to_datetime(value):
+    """ str -> str
+
+        Takes a date and time in any format dateutil understands and returns it
+         in UTC as an ISO 8601 string, which sorts and compares in time order.
+         Times without a time zone are taken to be UTC.
+
+    """
+    from dateutil import parser, tz
+    d = parser.parse(value)
+    if d.tzinfo is not None:
+        d = d.astimezone(tz.tzutc())
+    return d.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+CONVERTERS = {"int": int, "float": float, "datetime": to_datetime}
+
+
+def infer_types(columns, start):
+    """ list, int -> dict
+
+        Takes the column names and the byte offset of the first row.  Reads the
+         first inferRows rows with pandas and returns the type of each column
+         in import_list by name: int, float, datetime or string.  Values with
+         leading zeros are left as strings.
+
+    """
+    try:
+        import pandas as pd
+    except ImportError:
+        raise ImportError("Inferring column types requires pandas")
+
+    with open(CSV_FILE, 'rb') as f:
+        f.seek(start)
+        sample = pd.read_csv(f, header=None, usecols=import_list, dtype=str,
+                             keep_default_na=False, quotechar='\"',
+                             nrows=inferRows)
+
+    types = {}
+    for c in import_list:
+        values = sample[c][sample[c] != ""]
+        if len(values) == 0:
+            kind = "string"
+        elif values.str.match(r"^[-+]?(0|[1-9][0-9]*)$").all():
+            kind = "int"
+        elif (~values.str.match(r"^[-+]?0[0-9]")).all() and \
+             pd.to_numeric(values, errors="coerce").notnull().all():
+            kind = "float"
+        elif pd.to_datetime(values, errors="coerce").notnull().all():
+            kind = "datetime"
+        else:
+            kind = "string"
+        types[columns[c]] = kind
+    return types
+
+
+def set_column_types(types):
+    """ dict -> NoneType
+
+        Takes a dict of column name to type and sets columnConverters.
+
+    """
+    columnConverters.clear()
+    for name, kind in types.items():
+        if kind != "string":
+            columnConverters[name] = CONVERTERS[kind]
+
+
+def coerce(name, value):
+    """ str, str -> value
+
+        Takes a column name and a cell and returns the cell converted to the
+         column's type.  Cells that don't convert are returned unchanged.
+
+    """
+    conv = columnConverters.get(name)
+    if conv is None:
+        return value
+    try:
+        return conv(value)
+    except (ValueError, OverflowError):
+        logging.debug("Couldn't convert {0} value {1}".format(name, value))
+        return value
+
+
+def import_row(row, line_num, attributes):
+    """ list, int, list -> NoneType
+
+        Takes a row of the csv file, its line number, and the column names and
+         imports the row into the database.
+
+    """
+    _row.created = set()
+
+    # get the root node for the row
+    with stats.stage("anchor"):
+        hostNode = create_row_anchor(row, line_num)
+    # a new anchor can't have a parent yet
+    newAnchor = (_plan is None and _offline is None and _coordinator is None
+                 and hostNode._id in _row.created)
+
+    # Import the columns in the csv and link to the host node
+    for c in import_list:
+        if row[c]:
+            attr = {"Class":"attribute",
+                    "attribute":attributes[c],
+                    attributes[c]:coerce(attributes[c], row[c])}
+            with stats.stage("attribute"):
+                attrNode, b = get_or_create_node(attr)
+            # connect the attribute to the host with an edge
+            # Slight speedup.  If attrNode or hostNode is new, just create edge)
+            if not b or newAnchor:
+                create_edge(hostNode, attrNode, "described_by")
+            else:
+                get_or_create_edge(hostNode, attrNode, "described_by")
+
+    # Link the hostNode to a parent in the graph
+    parentNode = get_parent(hostNode, row)
+    if parentNode:
+        if newAnchor:
+            # skip the check and create the edge with the next bulk write
+            _parentEdges.append((parentNode, hostNode))
+            if len(_parentEdges) >= parentBatchSize:
+                flush_parent_edges()
+        else:
+            get_or_create_edge(parentNode,hostNode,parentRelationshipType)
+
+
+class Coordinator(object):
+    """ Locks shared between workers so two workers never create the same node
+        or relationship.  Keys are guarded by a fixed set of locks chosen by
+        hash, and whoever holds a key's lock looks it up in the database
+        before creating it.  Worker processes share the locks through a
+        multiprocessing manager.  Threads in one process use plain locks.
+
+    """
+    def __init__(self, manager=None, stripes=64):
+        if manager is None:
+            self.locks = [threading.Lock() for i in range(stripes)]
+        else:
+            self.locks = [manager.Lock() for i in range(stripes)]
+
+    def lock(self, key):
+        """ hashable_obj -> lock
+
+            Takes a node or relationship key and returns the lock guarding it.
+        """
+        return self.locks[hash(key) % len(self.locks)]
+
+
+class Fingerprints(object):
+    """ A hash of each imported row's contents by row_key, kept in a sqlite
+        database so it lasts between imports and can be shared by workers.
+        Each save is committed on its own and the database is in WAL mode, so
+        workers don't wait on each other's writes for long.
+
+    """
+    def __init__(self, path):
+        import sqlite3
+        # access is serialized by self.lock
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.execute("CREATE TABLE IF NOT EXISTS fingerprints (key TEXT PRIMARY KEY, digest TEXT)")
+        self.lock = threading.Lock()
+        self.skipped = 0
+
+    def check(self, row, line_num):
+        """ list, int -> (str, str) or None
+
+            Takes a row and its line number.  Returns None if the row is
+             unchanged since it was last saved, otherwise its (key, digest) to
+             save once it's imported.
+        """
+        key = str(row_key(row, line_num))
+        digest = hashlib.sha1("\x00".join(row)).hexdigest()
+        with self.lock:
+            r = self.db.execute("SELECT digest FROM fingerprints WHERE key = ?",
+                                (key,)).fetchone()
+        if r is not None and r[0] == digest:
+            self.skipped += 1
+            return None
+        return key, digest
+
+    def save(self, key, digest):
+        """ str, str -> NoneType
+
+            Takes a row's key and digest and saves them.  Call once the row has
+             been committed.
+        """
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?)",
+                            (key, digest))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class Pipeline(object):
+    """ Imports rows on a pool of threads so several rows are waiting on the
+        database at once.  Rows are imported in any order.  Errors are raised
+        by the next put or join.
+
+    """
+    def __init__(self, depth):
+        self.queue = Queue.Queue(depth * 2)
+        self.errors = []
+        self.threads = []
+        for i in range(depth):
+            t = threading.Thread(target=self.run)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                import_row(*item)
+            except Exception as e:
+                logging.error("Line {0} failed: {1}".format(item[1], e))
+                self.errors.append(e)
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        if self.errors:
+            raise self.errors[0]
+
+    def put(self, row, line_num, columns):
+        """ list, int, list -> NoneType
+
+            Takes a row, its line number and the column names, and queues the
+             row for import.
+        """
+        self.check()
+        self.queue.put((row, line_num, columns))
+
+    def join(self):
+        """ Waits for every queued row to be imported. """
+        self.queue.join()
+        self.check()
+
+    def close(self):
+        """ Stops the threads. """
+        for t in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+
+
+def read_rows(f, start, end, line_num, partial=True):
+    """ file, int, int, int, bool -> generator of (list, int, int)
+
+        Takes an open csv file, the byte offsets to start and stop reading at
+         (end of None reads to the end of the file), the number of lines
+         before start, and whether a last row cut off by the end of the file
+         is complete.  Yields each row, its line number, and the byte offset
+         just past it.  A row with quoted newlines that's still open at end is
+         read past end until it's finished.  If partial is False, a row
+         without a line ending or with an unclosed quote at the end of the
+         file isn't yielded.
+
+    """
+    # the offset and line number just past the lines read so far, whether
+    #  they end on a finished row, and whether the end of the file cut
+    #  them off
+    position = [start, line_num, True, False]
+
+    def lines():
+        # only stop at end between rows
+        while end is None or position[0] < end or not position[2]:
+            line = f.readline()
+            if not line.endswith("\n"):
+                position[3] = True
+            if not line:
+                return
+            position[0] += len(line)
+            position[1] += 1
+            position[2] = False
+            yield line
+
+    f.seek(start)
+    # the reader only asks for the next line when its row needs it, so
+    #  position is just past each row when it's returned
+    reader = csv.reader(lines(), delimiter=',', quotechar='\"')
+    while True:
+        with stats.stage("parse"):
+            row = next(reader, None)
+        if row is None or (position[3] and not partial):
+            return
+        position[2] = True
+        yield row, position[1], position[0]
+
+
+def split_ranges(filename, n, start, line_num):
+    """ str, int, int, int -> list of (int, int, int)
+
+        Takes a csv filename, a number of ranges, the byte offset to start at
+         and the number of lines before it.  Splits the rest of the file into n
+         ranges that start at the beginning of a line.  Returns (start, end,
+         lines before start) for each range.  A row with a quoted newline can
+         be split between ranges, so the file mustn't have any.
+
+    """
+    size = os.path.getsize(filename)
+    bounds = [start]
+    with open(filename, 'rb') as f:
+        for i in range(1, n):
+            # move each split point forward to the start of the next line
+            f.seek(start + (size - start) * i / n)
+            f.readline()
+            pos = f.tell()
+            if bounds[-1] < pos < size:
+                bounds.append(pos)
+        bounds.append(size)
+
+        # count the lines in each range so row numbers match a serial import
+        ranges = []
+        f.seek(start)
+        for i in range(len(bounds) - 1):
+            ranges.append((bounds[i], bounds[i + 1], line_num))
+            remaining = bounds[i + 1] - bounds[i]
+            while remaining > 0:
+                chunk = f.read(min(remaining, 1024 * 1024))
+                line_num += chunk.count("\n")
+                remaining -= len(chunk)
+
+    return ranges
+
+
+def checkpoint_path(index):
+    """ int -> str
+
+        Takes a worker number and returns the path of its checkpoint file.
+
+    """
+    return "{0}.{1}".format(checkpointFile, index)
+
+
+def write_checkpoint(index, end, offset, line_num, columns):
+    """ int, int, int, int, list -> NoneType
+
+        Takes a worker number, the end of its byte range, the byte offset and
+         line number of the last committed row, and the column names and saves
+         them.  The file is replaced atomically so a crash never leaves a
+         partial checkpoint.  Bulk-load files can't be resumed so nothing is
+         saved when writing them.
+
+    """
+    if _offline is not None:
+        return
+
+    path = checkpoint_path(index)
+    with open(path + ".tmp", 'w') as f:
+        json.dump({"file": CSV_FILE,
+                   "index": index,
+                   "end": end,
+                   "offset": offset,
+                   "line_num": line_num,
+                   "columns": columns}, f)
+    os.rename(path + ".tmp", path)
+
+
+def read_checkpoints():
+    """ NoneType -> list of dicts
+
+        Returns the saved checkpoints for CSV_FILE ordered by worker number.
+
+    """
+    checkpoints = []
+    for path in glob.glob(checkpointFile + ".*"):
+        if path.endswith(".tmp"):
+            continue
+        with open(path, 'r') as f:
+            cp = json.load(f)
+        if cp["file"] == CSV_FILE:
+            checkpoints.append(cp)
+    return sorted(checkpoints, key=lambda cp: cp["index"])
+
+
+def clear_checkpoints():
+    """ NoneType -> NoneType
+
+        Removes the checkpoints from a previous import.
+
+    """
+    for path in glob.glob(checkpointFile + ".*"):
+        os.remove(path)
+
+
+def import_range(columns, start, end, line_num, index=0):
+    """ list, int, int, int, int -> int
+
+        Takes the column names, a byte range of the csv file, the number of
+         lines before the range, and the worker number.  Imports the rows in the
+         range, checkpointing as rows are committed, and returns the number of
+         rows imported.
+
+    """
+    global _coordinator
+
+    stats.worker = index
+    batching = batchSize > 1 and _coordinator is None and _offline is None
+    batchRows = batchSize if batching else 0
+
+    # Threads need a coordinator too.  Worker processes already have one.
+    pipeline = None
+    threadCoordinator = None
+    if pipelineDepth > 1 and not batching and _offline is None:
+        if _coordinator is None:
+            threadCoordinator = _coordinator = Coordinator()
+        pipeline = Pipeline(pipelineDepth)
+
+    try:
+        with open(CSV_FILE, 'rb') as f:
+            counter, committed = import_rows(f, columns, start, end, line_num,
+                                             index, batchRows, pipeline)
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+        if threadCoordinator is not None:
+            _coordinator = None
+
+    # mark the range as finished
+    flush_parent_edges()
+    write_checkpoint(index, end, committed[0], committed[1], columns)
+    stats.emit()
+
+    return counter
+
+
+def import_rows(f, columns, start, end, line_num, index, batchRows, pipeline,
+                partial=True):
+    """ file, list, int, int, int, int, int, Pipeline, bool -> int, (int, int)
+
+        Takes the open csv file and the arguments of import_range, the number
+         of rows to import together in a batch (0 to import a row at a time),
+         the Pipeline to import rows on (or None), and whether a last row cut
+         off by the end of the file is complete (see read_rows).
+         Imports the rows and returns the number of rows and the (offset, line
+         number) of the last one.
+
+    """
+    counter = 0
+    rows = []
+    pending = [] # fingerprints to save once their rows are committed
+    committed = (start, line_num)
+
+    # for line in csv
+    for row, line_num, offset in read_rows(f, start, end, line_num, partial):
+        logging.debug(row)
+
+        # skip rows that haven't changed since the last import
+        fingerprint = None
+        if fingerprints is not None:
+            fingerprint = fingerprints.check(row, line_num)
+            if fingerprint is None:
+                committed = (offset, line_num)
+                continue
+
+        if batchRows:
+            rows.append((row, line_num))
+            if fingerprint is not None:
+                pending.append(fingerprint)
+            if len(rows) >= batchRows:
+                import_batch(rows, columns)
+                rows = []
+                for fp in pending:
+                    fingerprints.save(*fp)
+                pending = []
+                write_checkpoint(index, end, offset, line_num, columns)
+        else:
+            if pipeline is not None:
+                pipeline.put(row, line_num, columns)
+            else:
+                import_row(row, line_num, columns)
+            # new anchors' parent edges wait for flush_parent_edges, so the
+            #  fingerprint waits for them
+            if fingerprint is not None:
+                pending.append(fingerprint)
+            if (counter + 1) % checkpointInterval == 0:
+                if pipeline is not None:
+                    # rows finish out of order so wait for all of them
+                    pipeline.join()
+                flush_parent_edges()
+                for fp in pending:
+                    fingerprints.save(*fp)
+                pending = []
+                write_checkpoint(index, end, offset, line_num, columns)
+        committed = (offset, line_num)
+
+        # increment counter
+        if counter % 10 == 0:
+            print line_num
+        counter += 1
+        stats.row()
+
+    # import any rows left in a partial batch
+    if rows:
+        import_batch(rows, columns)
+    if pipeline is not None:
+        pipeline.join()
+    flush_parent_edges()
+    for fp in pending:
+        fingerprints.save(*fp)
+
+    return counter, committed
+
+
+def read_header(f, partial=True):
+    """ file, bool -> list, int, int
+
+        Takes an open csv file and whether a header without a line ending is
+         complete.  Returns the column names, the byte offset of the first
+         row, and the number of lines before it.  Returns None if partial is
+         False and the header line hasn't been completely written yet.
+
+    """
+    if not columnHeaders:
+        return attributes, 0, 0
+    f.seek(0)
+    header = f.readline()
+    if not partial and not header.endswith("\n"):
+        return None
+    columns = csv.reader([header], delimiter=',', quotechar='\"').next()
+    return columns, len(header), 1
+
+
+def complete_end(f, start):
+    """ file, int -> int
+
+        Takes an open csv file and a byte offset.  Returns the offset just past
+         the last complete line at or after start, so a line still being
+         written isn't imported.
+
+    """
+    f.seek(0, 2)
+    pos = f.tell()
+    while pos > start:
+        step = min(65536, pos - start)
+        f.seek(pos - step)
+        i = f.read(step).rfind("\n")
+        if i >= 0:
+            return pos - step + i + 1
+        pos -= step
+    return start
+
+
+def follow_files():
+    """ NoneType -> int
+
+        Imports rows as they're appended to CSV_FILE, or as files matching
+         followPattern appear in it if it's a directory, checking every
+         followInterval seconds until interrupted.  Rows that have arrived
+         are imported together in batches of up to followBatchSize (or
+         batchSize if larger).  CSV_FILE is set to each file while its rows are
+         imported, so get_parent resolves the file once and each file gets its
+         own checkpoint.  Returns the number of rows imported.
+
+    """
+    global CSV_FILE
+
+    source = CSV_FILE
+    positions = {} # filename -> (offset, line number, columns)
+    counter = 0
+    batchRows = max(batchSize, followBatchSize)
+
+    try:
+        while True:
+            if os.path.isdir(source):
+                files = sorted(glob.glob(os.path.join(source, followPattern)))
+            else:
+                files = [source]
+
+            for name in files:
+                CSV_FILE = name
+                index = hashlib.sha1(name).hexdigest()[:8]
+                with open(name, 'rb') as f:
+                    # start new files from their checkpoint or header
+                    if name not in positions:
+                        checkpoints = read_checkpoints() if resume else []
+                        if checkpoints:
+                            cp = checkpoints[0]
+                            positions[name] = (cp["offset"], cp["line_num"], cp["columns"])
+                        else:
+                            header = read_header(f, False)
+                            if header is None:
+                                continue
+                            positions[name] = (header[1], header[2], header[0])
+
+                    offset, line_num, columns = positions[name]
+                    end = complete_end(f, offset)
+                    if end <= offset:
+                        continue
+                    n, committed = import_rows(f, columns, offset, end, line_num,
+                                               index, batchRows, None, False)
+
+                flush_parent_edges()
+                write_checkpoint(index, None, committed[0], committed[1], columns)
+                positions[name] = (committed[0], committed[1], columns)
+                counter += n
+
+            time.sleep(followInterval)
+    except KeyboardInterrupt:
+        print "Stopped following {0}.".format(source)
+    finally:
+        CSV_FILE = source
+
+    return counter
+
+
+def init_worker(coordinator):
+    """ Coordinator -> NoneType
+
+        Sets up a worker process with its own database connection and the
+         shared coordinator.
+
+    """
+    global G, _coordinator, fingerprints
+
+    G = neo4j.GraphDatabaseService(NEODB)
+    _coordinator = coordinator
+    # don't share the parent's sqlite connections
+    if isinstance(nodeStore.back, SqliteStore):
+        nodeStore.back = SqliteStore(dedupePath)
+    if fingerprints is not None:
+        fingerprints = Fingerprints(fingerprintFile)
+
+
+def run_worker(args):
+    """ tuple -> int
+
+        Takes (columns, start, end, line_num, index) and runs import_range in
+         a worker.
+
+    """
+    return import_range(*args)
+
+
+def import_parallel(columns, ranges):
+    """ list, list of tuples -> int
+
+        Takes the column names and a list of (start, end, lines before start,
+         worker number) byte ranges of the csv file.  Imports each range in a
+         worker process.  The workers share a Coordinator and import a row at a
+         time.  Returns the number of rows imported.
+
+    """
+    manager = multiprocessing.Manager()
+    coordinator = Coordinator(manager)
+    pool = multiprocessing.Pool(len(ranges), init_worker, (coordinator,))
+    try:
+        counts = pool.map(run_worker, [(columns,) + r for r in ranges])
+    finally:
+        pool.close()
+        pool.join()
+        manager.shutdown()
+
+    return sum(counts)
+
+
+def main():
+    global startRow, _offline, fingerprints
+
+    if follow and offlineDir:
+        raise ValueError("Bulk-load files can't be written while following")
+
+    # pick up where the last import left off
+    checkpoints = read_checkpoints() if resume and not offlineDir and not follow else []
+    if follow:
+        # follow_files finds each file's start
+        ranges = []
+    elif checkpoints:
+        columns = checkpoints[0]["columns"]
+        ranges = [(cp["offset"], cp["end"], cp["line_num"], cp["index"])
+                  for cp in checkpoints]
+        print "Resuming import from line {0}.".format(
+            min(cp["line_num"] for cp in checkpoints))
+    else:
+        # open csv
+        with open(CSV_FILE, 'rb') as f:
+            # if there are column headers, read them
+            columns, offset, line_num = read_header(f)
+            if columnHeaders and startRow is not 0:
                 startRow -= 1
-            
-        # skip to a specific row based on startRow variable
-        for i in range(1,startRow):
-            linereader.next()
 
+            # skip to a specific row based on startRow variable
+            rows = read_rows(f, offset, None, line_num)
+            for i in range(1,startRow):
+                row, line_num, offset = next(rows, (None, line_num, offset))
 
-        print "Starting import at {0}.".format(
-            datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'))
+        if workers > 1 and not offlineDir:
+            ranges = [r + (i,) for i, r in enumerate(
+                split_ranges(CSV_FILE, workers, offset, line_num))]
+        else:
+            ranges = [(offset, None, line_num, 0)]
 
-        counter = 0
+        # checkpoint every range before it starts so --resume still finds a
+        #  range whose worker dies before its first checkpoint.  Bulk-load
+        #  files aren't checkpointed, so a database import's checkpoints are
+        #  left alone.
+        if not offlineDir:
+            clear_checkpoints()
+            for rangeStart, rangeEnd, rangeLine, index in ranges:
+                write_checkpoint(index, rangeEnd, rangeStart, rangeLine, columns)
 
-        # for line in csv
-        for row in linereader:
-            logging.debug(row)
-            
-            # get the root node for the row
-            hostNode = create_row_anchor(row, linereader.line_num)
 
-            # Import the columns in the csv and link to the host node
-            for c in import_list:
-                if row[c]:
-                    attr = {"Class":"attribute",
-                            "attribute":attributes[c],
-                            attributes[c]:row[c]}
-                    attrNode, b = get_or_create_node(attr)
-                    # connect the attribute to the host with an edge
-                    # Slight speedup.  If attrNode is new, just create edge)
-                    if b:
-                        G.create((hostNode, "described_by", attrNode))
-                    else:
-                        get_or_create_edge(hostNode, attrNode, "described_by")
-
-            # Link the hostNode to a parent in the graph
-            parentNode = get_parent(hostNode, row)
-            if parentNode:
-                get_or_create_edge(parentNode,hostNode,parentRelationshipType)
-
-            # increment counter
-            if counter % 10 == 0:
-                print linereader.line_num
-            counter += 1
-
-            
+    print "Starting import at {0}.".format(
+        datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+    # work out what type to store each column as
+    types = {}
+    if inferTypes and ranges:
+        types = infer_types(columns, min(r[0] for r in ranges))
+    types.update(columnTypes)
+    set_column_types(types)
+
+    if not offlineDir:
+        if dedupeStore == "dbm" and len(ranges) > 1:
+            raise ValueError("The dbm dedupe store can't be shared between workers")
+        nodeStore.back = open_store(dedupeStore, dedupePath)
+        # planned nodes must not be evicted
+        if planAttributes and nodeStore.back is None:
+            nodeStore.back = MemoryStore()
+        if fingerprintFile:
+            fingerprints = Fingerprints(fingerprintFile)
+
+    # create the attribute nodes up front.  Workers inherit nodeStore.
+    if planAttributes and not offlineDir and ranges:
+        n = plan_attributes(columns, min(r[0] for r in ranges))
+        print "Planned {0} attribute nodes at {1}.".format(
+            n, datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+    if follow:
+        counter = follow_files()
+    elif offlineDir:
+        _offline = OfflineGraph(offlineDir, columns)
+        try:
+            counter = import_range(columns, *ranges[0])
+        finally:
+            _offline.close()
+        print "Wrote {0} to {1}.".format(_offline, offlineDir)
+    elif len(ranges) > 1:
+        counter = import_parallel(columns, ranges)
+    else:
+        counter = import_range(columns, *ranges[0])
+        print "Node cache: {0}".format(nodeCache)
+    nodeStore.close()
+    if fingerprints is not None:
+        # workers skip rows in their own processes
+        if len(ranges) == 1:
+            print "Skipped {0} unchanged rows.".format(fingerprints.skipped)
+        fingerprints.close()
+
+    print "Imported {0} rows.".format(counter)
     print "Done at {0}.".format(datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'))
    
 
 if __name__ == "__main__":
-    main()    
+    parser = argparse.ArgumentParser(description="Imports a csv file into a database.")
+    parser.add_argument("--workers", type=int, default=workers,
+                        help="number of processes to import with")
+    parser.add_argument("--resume", action="store_true", default=resume,
+                        help="continue from the last checkpoint")
+    parser.add_argument("--offline", metavar="DIR", default=offlineDir,
+                        help="write bulk-load files to DIR instead of the database")
+    parser.add_argument("--plan", action="store_true", default=planAttributes,
+                        help="create the attribute nodes before importing rows")
+    parser.add_argument("--stats", metavar="FILE", default=statsFile,
+                        help="append per-stage timings to FILE as JSON lines")
+    parser.add_argument("--pipeline", type=int, default=pipelineDepth,
+                        help="number of rows to import at once on threads")
+    parser.add_argument("--fingerprints", metavar="FILE", default=fingerprintFile,
+                        help="skip rows unchanged since the last import, remembered in FILE")
+    parser.add_argument("--follow", action="store_true", default=follow,
+                        help="keep importing rows as they're added to CSV_FILE")
+    args = parser.parse_args()
+    follow = args.follow
+    fingerprintFile = args.fingerprints
+    pipelineDepth = args.pipeline
+    stats.path = args.stats
+    planAttributes = args.plan
+    workers = args.workers
+    resume = args.resume
+    offlineDir = args.offline
+
+    main()
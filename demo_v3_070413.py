@@ -32,17 +32,23 @@ graph.  Nodes with the same name are combined into a single node.
 DEPENDS ON:
 py2neo
 networkx
+numpy
+scipy
 websocket-client
-jenkins (used for getting 32int hashes for use with xml-rpc)
 
 NOTES:
 -To remove any of the 4 graphs, comment out the appropriate part of the
  following sections:
  1. Static Variables
  2. Setup
- 3. Node and edge import (both the 1st node & looping section
--Jenkins is a binary package and required I move lookup3.so on install
- It can be replaced with any 32bit hash function.
+ 3. The graph's Sink in main()
+-PACE sets how fast each graph is sent its nodes and edges.  Set every
+ graph to "fast" for batch runs.
+-Each graph is sent its nodes and edges on its own thread so a slow graph
+ doesn't hold up the others.
+-Every graph uses the same node and edge ids, handed out in order by a
+ Registry as names and edges are first seen.  They're small ints so they
+ fit xml-rpc's 32bit ints.
 
 """
 
@@ -50,11 +56,15 @@ NOTES:
 from py2neo import neo4j, cypher
 import networkx as nx
 import xmlrpclib # For UBIGRAPH
-from time import sleep
+from time import sleep, time
 from websocket import create_connection # for gephi
 import json # for gephi
 import csv
-import jenkins
+import numpy as np
+import scipy.sparse as sp
+import threading
+import Queue
+from array import array
 
 ## STATIC VARIABLES
 GEXF_FILE = "/home/gabe/Development/CFP/Derbycon/output.gexf"
@@ -62,11 +72,26 @@ CSV_FILE = "/home/gabe/Development/CFP/Derbycon/attack_paths_v2.csv"
 NEODB = "http://localhost:7474/db/data"
 UBIGRAPH = "http://localhost:20738/RPC2"
 GEPHI = "ws://localhost:8080/workspace0"
+NEO_INDEX = True # look up neo4j nodes through a "name" index instead of scanning
 CLASSES = {"ac":"actor", "at":"attribute", "e":"event", "c":"condition"}
-sleep1 = .3 # time in seconds to sleep between adding nodes
-sleep2 = 2 # time in seconds to sleep between adding paths
 sleep3 = .3 # time to sleep between setup steps
 sleep4 = 3 # time to sleep between setup and import
+# How fast each graph is sent its nodes and edges: "fast" (as fast as the
+#  graph takes them), "rate" (PACE_RATE a second) or "replay" (as the paths
+#  were observed, from TIME_COLUMN, sped up REPLAY_SPEED times)
+PACE = {"neo4j":"fast", "networkx":"fast", "ubigraph":"rate", "gephi":"rate"}
+PACE_RATE = 5 # nodes and edges per second for "rate" graphs
+PACE_BURST = 10 # most nodes and edges a "rate" graph gets at once after idling
+TIME_COLUMN = None # column of each path's observed time in epoch seconds (path nodes follow it), or None
+REPLAY_SPEED = 60 # seconds of observed time replayed per second
+ANALYZE = True # add path analytics to the gexf file's nodes and edges
+ANALYZE_CHUNK = 32 # actors searched from at once; each costs a few arrays the size of the graph
+QUEUE_SIZE = 1000 # nodes and edges each graph can have waiting
+GEPHI_BATCH = 100 # most gephi events to send in one websocket message
+GEPHI_FLUSH = .5 # most time in seconds a gephi event waits to be sent
+GEPHI_WINDOW = 60 # time in seconds a node sent to gephi isn't sent again
+UBIGRAPH_BATCH = 50 # most ubigraph calls to send in one xml-rpc request
+FLUSH_IDLE = .5 # time in seconds a graph waits idle before sending buffered events
 
 ## SETUP
 
@@ -78,6 +103,8 @@ print "---------------------"
 print "Setting up Neo4j"
 graph_db = neo4j.GraphDatabaseService(NEODB)
 graph_db.clear()
+if NEO_INDEX:
+    name_index = graph_db.get_or_create_index(neo4j.Node, "name")
 
 # Connect to Ubigraph
 sleep(sleep3)
@@ -109,6 +136,456 @@ sleep(sleep4)
 
 
 ## EXECUTION
+class GephiWriter(object):
+    """ Buffers gephi streaming events and sends them as multi-object
+        {"an":{...}} and {"ae":{...}} messages when GEPHI_BATCH events are
+        waiting or the oldest has waited GEPHI_FLUSH seconds.  Nodes sent in
+        the last GEPHI_WINDOW seconds aren't sent again.  Works with anything
+        that has a send(str) method, such as a websocket or a test stand-in.
+
+    """
+    def __init__(self, ws, size=GEPHI_BATCH, interval=GEPHI_FLUSH,
+                 window=GEPHI_WINDOW):
+        self.ws = ws
+        self.size = size
+        self.interval = interval
+        self.window = window
+        self.nodes = {}
+        self.edges = {}
+        self.count = 0
+        self.first = None # when the oldest waiting event was added
+        self.sent = set() # node ids sent in this window
+        self.windowStart = time()
+
+    def add_node(self, nodeID, attr):
+        """int, dict -> NoneType
+
+            Takes a node id and attributes and queues the node.
+        """
+        if nodeID in self.nodes or nodeID in self.sent:
+            return
+        self.nodes[nodeID] = attr
+        self.added()
+
+    def add_edge(self, edgeID, attr):
+        """int, dict -> NoneType
+
+            Takes an edge id and attributes and queues the edge.
+        """
+        self.edges[edgeID] = attr
+        self.added()
+
+    def added(self):
+        self.count += 1
+        if self.first is None:
+            self.first = time()
+        if self.count >= self.size or time() - self.first >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """NoneType -> NoneType
+
+            Sends everything waiting.  Nodes go first so edges never refer
+             to a node gephi hasn't seen.
+        """
+        if self.nodes:
+            self.ws.send(json.dumps({"an":self.nodes}))
+            self.sent.update(self.nodes)
+        if self.edges:
+            self.ws.send(json.dumps({"ae":self.edges}))
+        self.nodes = {}
+        self.edges = {}
+        self.count = 0
+        self.first = None
+        if time() - self.windowStart >= self.window:
+            self.sent = set()
+            self.windowStart = time()
+
+
+class UbigraphWriter(object):
+    """ Queues ubigraph calls and sends UBIGRAPH_BATCH of them at a time in
+        one request with xmlrpclib.MultiCall.  Remembers the vertices and
+        edges sent this session so they aren't sent again.
+
+    """
+    def __init__(self, server, size=UBIGRAPH_BATCH):
+        self.server = server
+        self.size = size
+        self.calls = xmlrpclib.MultiCall(server)
+        self.count = 0
+        self.vertices = set()
+        self.edges = set()
+
+    def new_vertex(self, vertexID, label):
+        """int, str -> NoneType
+
+            Takes a vertex id and label and queues creating the vertex.
+        """
+        if vertexID in self.vertices:
+            return
+        self.vertices.add(vertexID)
+        self.calls.ubigraph.new_vertex_w_id(vertexID)
+        self.calls.ubigraph.set_vertex_attribute(vertexID, "label", label)
+        self.added(2)
+
+    def new_edge(self, edgeID, sourceID, targetID):
+        """int, int, int -> NoneType
+
+            Takes an edge id and source and target vertex ids and queues
+             creating the edge.
+        """
+        if edgeID in self.edges:
+            return
+        self.edges.add(edgeID)
+        self.calls.ubigraph.new_edge_w_id(edgeID, sourceID, targetID)
+        self.added(1)
+
+    def added(self, n):
+        self.count += n
+        if self.count >= self.size:
+            self.flush()
+
+    def flush(self):
+        """NoneType -> NoneType
+
+            Sends every queued call.  Raises xmlrpclib.Fault if any failed.
+        """
+        if self.count:
+            calls = self.calls
+            self.calls = xmlrpclib.MultiCall(self.server)
+            self.count = 0
+            # reading the results raises any faults
+            list(calls())
+
+
+class Registry(object):
+    """ Hands out dense integer ids: one per node name and one per
+        (source id, target id) edge, in the order they're first seen.  Names
+        are kept in a list indexed by id and edge endpoints in two int
+        arrays indexed by edge id, so each id costs a dict entry and a slot.
+
+    """
+    def __init__(self):
+        self.ids = {} # node name -> id
+        self.names = [] # id -> node name
+        self.edgeIDs = {} # (source id, target id) -> edge id
+        self.sources = array("i") # edge id -> source id
+        self.targets = array("i") # edge id -> target id
+
+    def node(self, name):
+        """str -> int
+
+            Takes a node name and returns its id, adding it if it's new.
+        """
+        nodeID = self.ids.get(name)
+        if nodeID is None:
+            nodeID = len(self.names)
+            self.ids[name] = nodeID
+            self.names.append(name)
+        return nodeID
+
+    def edge(self, sourceID, targetID):
+        """int, int -> int
+
+            Takes source and target node ids and returns the edge's id,
+             adding it if it's new.
+        """
+        key = (sourceID, targetID)
+        edgeID = self.edgeIDs.get(key)
+        if edgeID is None:
+            edgeID = len(self.sources)
+            self.edgeIDs[key] = edgeID
+            self.sources.append(sourceID)
+            self.targets.append(targetID)
+        return edgeID
+
+
+class Paths(object):
+    """ Every hop of every attack path in columnar numpy arrays, one entry
+        per hop in file order: path (index into pathIDs), hop (position in
+        its path), node (Registry id) and Class (index into classes).  when
+        holds each path's observed time, nan if there's no TIME_COLUMN.  The
+        distinct edges, in the order they're first seen, are in source,
+        target, edge (Registry edge id), count (hops across all paths),
+        first and last (earliest and latest observed time, nan without a
+        TIME_COLUMN).  The paths each edge is on are edgePaths[
+        edgePathStart[i]:edgePathStart[i + 1]] for edge i.
+
+    """
+    def __init__(self, registry):
+        self.registry = registry
+        self.pathIDs = []
+        self.classes = sorted(CLASSES)
+
+    def load(self, lineReader):
+        """csv reader -> NoneType
+
+            Reads every path from the csv reader and fills in the arrays.
+        """
+        classCodes = dict((c, i) for i, c in enumerate(self.classes))
+        path, hop, node, Class, when = [], [], [], [], []
+        for line in lineReader:
+            if not line:
+                continue
+            pathIndex = len(self.pathIDs)
+            self.pathIDs.append(line[0])
+            if TIME_COLUMN is None:
+                when.append(np.nan)
+                first = 1
+            else:
+                when.append(float(line[TIME_COLUMN]))
+                first = TIME_COLUMN + 1
+            for i in range(first, len(line)):
+                name, _, c = line[i].partition(":")
+                code = classCodes.get(c)
+                if code is None:
+                    code = classCodes[c] = len(self.classes)
+                    self.classes.append(c)
+                path.append(pathIndex)
+                hop.append(i - first)
+                node.append(self.registry.node(name))
+                Class.append(code)
+
+        self.path = np.array(path, dtype=np.int32)
+        self.hop = np.array(hop, dtype=np.int32)
+        self.node = np.array(node, dtype=np.int32)
+        self.Class = np.array(Class, dtype=np.int16)
+        self.when = np.array(when, dtype=np.float64)
+        self.find_edges()
+
+    def find_edges(self):
+        # An edge joins each hop to the next one on the same path
+        rows = np.nonzero(self.path[1:] == self.path[:-1])[0] + 1
+        sources = self.node[rows - 1].astype(np.int64)
+        targets = self.node[rows].astype(np.int64)
+        keys, first, inverse, counts = np.unique((sources << 32) | targets,
+                                                 return_index=True,
+                                                 return_inverse=True,
+                                                 return_counts=True)
+        order = np.argsort(first)
+        first = first[order]
+        self.source = sources[first].astype(np.int32)
+        self.target = targets[first].astype(np.int32)
+        self.count = counts[order].astype(np.int32)
+        self.edgeRow = rows[first] # hop each edge is first seen on
+        self.edge = np.array([self.registry.edge(s, t) for s, t in
+                              zip(self.source.tolist(), self.target.tolist())],
+                             dtype=np.int32)
+
+        # Each hop's edge, numbered in first seen order
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        hopEdge = rank[inverse]
+
+        # The distinct paths on each edge, grouped by edge
+        pathCount = max(len(self.pathIDs), 1)
+        onPath = np.unique(hopEdge * pathCount + self.path[rows])
+        self.edgePaths = (onPath % pathCount).astype(np.int32)
+        self.edgePathStart = np.concatenate(([0], np.cumsum(
+            np.bincount(onPath // pathCount, minlength=len(order)))))
+
+        # Observed times of each edge
+        self.first = np.empty(len(order))
+        self.first.fill(np.nan)
+        self.last = self.first.copy()
+        times = self.when[self.path[rows]]
+        np.fmin.at(self.first, hopEdge, times)
+        np.fmax.at(self.last, hopEdge, times)
+
+    def events(self):
+        """NoneType -> generator of (str, dict, float)
+
+            Yields each distinct node and edge once, as ("node", node dict,
+             when) or ("edge", edge dict, when).  when is the earliest time
+             it's observed, or None without a TIME_COLUMN.  With a
+             TIME_COLUMN they're in order of when, so replays don't depend on
+             the file being sorted by time, otherwise in the order they're
+             first seen.  Each node comes before the edges that use it.
+        """
+        nodes, nodeRow, nodeOf = np.unique(self.node, return_index=True,
+                                           return_inverse=True)
+        rows = np.concatenate((nodeRow, self.edgeRow))
+        kinds = np.concatenate((np.zeros(len(nodes), dtype=np.int8),
+                                np.ones(len(self.edge), dtype=np.int8)))
+        index = np.concatenate((np.arange(len(nodes)),
+                                np.arange(len(self.edge))))
+        # A node is on every path its edges are on, so it's never observed
+        #  later than them and sorts first on a tie
+        nodeWhen = np.empty(len(nodes))
+        nodeWhen.fill(np.nan)
+        np.fmin.at(nodeWhen, nodeOf, self.when[self.path])
+        times = np.concatenate((nodeWhen, self.first))
+        if TIME_COLUMN is None:
+            order = np.lexsort((kinds, rows))
+        else:
+            order = np.lexsort((kinds, rows, times))
+        names = self.registry.names
+        for i in order.tolist():
+            row = int(rows[i])
+            when = float(times[i])
+            if when != when: # nan
+                when = None
+            j = int(index[i])
+            if kinds[i] == 0:
+                nodeID = int(nodes[j])
+                yield "node", {"name":names[nodeID],
+                               "Class":self.classes[self.Class[row]],
+                               "id":nodeID}, when
+            else:
+                yield "edge", self.edge_dict(j), when
+
+    def edge_dict(self, i):
+        """int -> dict
+
+            Takes an index into the distinct edges and returns its edge
+             dictionary with the edge's totals across every path.
+        """
+        start, end = self.edgePathStart[i], self.edgePathStart[i + 1]
+        edge = {"source":int(self.source[i]), "target":int(self.target[i]),
+                "id":int(self.edge[i]), "traversals":int(self.count[i]),
+                "paths":",".join(self.pathIDs[p] for p in
+                                 self.edgePaths[start:end].tolist())}
+        if TIME_COLUMN is not None:
+            edge["first_seen"] = float(self.first[i])
+            edge["last_seen"] = float(self.last[i])
+        return edge
+
+
+def shortest_path_counts(AT, sources):
+    """scipy csr matrix, numpy array -> numpy array, numpy array
+
+        Takes the transposed adjacency matrix and an array of source node
+         ids, and searches breadth first from every source at once.  Returns
+         the number of shortest paths from each source to each node and the
+         length of those paths (-1 if the node isn't reachable), each as a
+         nodes x sources array.
+    """
+    k = len(sources)
+    n = AT.shape[0]
+    sigma = np.zeros((n, k))
+    depth = np.empty((n, k), dtype=np.int32)
+    depth.fill(-1)
+    sigma[sources, np.arange(k)] = 1
+    depth[sources, np.arange(k)] = 0
+    frontier = sigma.copy()
+    d = 0
+    while frontier.any():
+        d += 1
+        # paths into each node from the last level
+        counts = AT.dot(frontier)
+        counts[depth >= 0] = 0
+        found = counts > 0
+        depth[found] = d
+        sigma[found] = counts[found]
+        frontier = np.where(found, sigma, 0)
+    return sigma, depth
+
+
+def dependencies(A, sigma, depth, targets):
+    """scipy csr matrix, numpy array, numpy array, numpy array -> numpy array
+
+        Takes the adjacency matrix, the path counts and lengths from
+         shortest_path_counts, and a nodes x 1 array marking the targets.
+         Returns how many shortest paths from each source to a target pass
+         through each node (Brandes' dependency), as a nodes x sources array.
+    """
+    delta = np.zeros(sigma.shape)
+    for d in range(depth.max(), 0, -1):
+        level = depth == d
+        coef = np.where(level, (targets + delta) / np.where(level, sigma, 1), 0)
+        # share of each node's successors on the next level
+        delta += np.where(depth == d - 1, sigma * A.dot(coef), 0)
+    # a source isn't between itself and its targets
+    delta[depth == 0] = 0
+    return delta
+
+
+def trace_path(AT, depth, target):
+    """scipy csr matrix, numpy array, int -> list
+
+        Takes the transposed adjacency matrix, one source's column of path
+         lengths and a reachable target, and returns the node ids of a
+         shortest path from the source to the target.
+    """
+    path = [target]
+    node = target
+    for d in range(depth[target] - 1, -1, -1):
+        previous = AT.indices[AT.indptr[node]:AT.indptr[node + 1]]
+        node = int(previous[depth[previous] == d][0])
+        path.append(node)
+    path.reverse()
+    return path
+
+
+def analyze_paths(paths, g, chunk=ANALYZE_CHUNK):
+    """Paths, networkx graph object, int -> NoneType
+
+        Takes the loaded paths and the networkx graph built from them and
+         adds to the graph:
+         edges: frequency (share of paths traversing the edge)
+         nodes: betweenness (shortest actor to condition paths through the
+          node) and actors (actors that can reach it)
+         actors: reach (nodes the actor can reach)
+         conditions: actor_distance (hops from the nearest actor, -1 if none
+          can reach it) and actor_path (a shortest path from that actor)
+    """
+    n = len(paths.registry.names)
+    A = sp.csr_matrix((np.ones(len(paths.source)), (paths.source, paths.target)),
+                      shape=(n, n))
+    AT = A.T.tocsr()
+
+    # Each node's class is the one it's first seen with
+    nodeClass = np.empty(n, dtype=np.int16)
+    nodeClass[paths.node[::-1]] = paths.Class[::-1]
+    codes = dict((CLASSES.get(c, c), i) for i, c in enumerate(paths.classes))
+    actors = np.nonzero(nodeClass == codes.get("actor", -1))[0]
+    isCondition = nodeClass == codes.get("condition", -1)
+    conditions = np.nonzero(isCondition)[0]
+
+    betweenness = np.zeros(n)
+    reachedBy = np.zeros(n, dtype=np.int32)
+    reach = np.zeros(n, dtype=np.int32)
+    distance = np.empty(n, dtype=np.int32)
+    distance.fill(-1)
+    actorPath = {}
+    for start in range(0, len(actors), chunk):
+        sources = actors[start:start + chunk]
+        sigma, depth = shortest_path_counts(AT, sources)
+        targets = isCondition[:, np.newaxis]
+        betweenness += dependencies(A, sigma, depth, targets).sum(axis=1)
+        reached = depth >= 0
+        reachedBy += reached.sum(axis=1)
+        reach[sources] = reached.sum(axis=0) - 1
+
+        # Keep the nearest actor of each condition
+        d = np.where(reached[conditions], depth[conditions], n)
+        nearest = d.argmin(axis=1)
+        best = d[np.arange(len(conditions)), nearest]
+        better = (best < n) & ((distance[conditions] < 0) |
+                               (best < distance[conditions]))
+        for i in np.nonzero(better)[0].tolist():
+            c = int(conditions[i])
+            distance[c] = best[i]
+            actorPath[c] = trace_path(AT, depth[:, nearest[i]], c)
+
+    names = paths.registry.names
+    for v in range(n):
+        attr = g.node[v]
+        attr["betweenness"] = float(betweenness[v])
+        attr["actors"] = int(reachedBy[v])
+    for v in actors.tolist():
+        g.node[v]["reach"] = int(reach[v])
+    for v in conditions.tolist():
+        g.node[v]["actor_distance"] = int(distance[v])
+        if v in actorPath:
+            g.node[v]["actor_path"] = " > ".join(names[u] for u in actorPath[v])
+    pathCount = float(max(len(paths.pathIDs), 1))
+    onPaths = np.diff(paths.edgePathStart)
+    for s, t, c in zip(paths.source.tolist(), paths.target.tolist(),
+                       onPaths.tolist()):
+        g[s][t]["frequency"] = c / pathCount
+
+
 def import_node_to_neo(graph_db, node):
     """py2neo graph object, dict -> py2neo node, bool
 
@@ -117,6 +594,13 @@ def import_node_to_neo(graph_db, node):
          returns the node.
          
     """
+    # Nodes with the same name are combined, so the name index is enough
+    if NEO_INDEX:
+        data = name_index.get("name", node["name"])
+        if data:
+            return data[0], True
+        return name_index.get_or_create("name", node["name"], node), False
+
     # Build the query string
     s = ""
     for key in node:
@@ -141,20 +625,15 @@ def import_node_to_neo(graph_db, node):
     return d, b
 
 
-def import_node_to_ubigraph(u, node):
-    """xmlrpc server, dict -> NoneType 
+def import_node_to_ubigraph(ubi, node):
+    """UbigraphWriter, dict -> NoneType 
 
-        Takes an xml rpc server and a node dictionary and sends
+        Takes a UbigraphWriter and a node dictionary and sends
          the node to the ubigraph server.
          
     """
-    name = jenkins.hashlittle(node["name"])
-
-    # Create Node
-    u.new_vertex_w_id(name)
-
-    # Add node name as a label
-    u.set_vertex_attribute(name, "label", node["name"])
+    # Create Node with the node name as a label
+    ubi.new_vertex(node["id"], node["name"])
 
 
 def import_node_to_networkx(g, node):
@@ -167,29 +646,30 @@ def import_node_to_networkx(g, node):
     # Create a copy of the node dictionary
     n = node.copy()
     
-    name = n.pop("name")
+    nodeID = n.pop("id")
+
+    # gexf uses the label as the node's name
+    n["label"] = n["name"]
     
     # create node with attributes
-    g.add_node(name, attr_dict=n)
+    g.add_node(nodeID, attr_dict=n)
 
 
-def import_node_to_gephi(graph_ws, node):
-    """websocket, dict -> NoneType
+def import_node_to_gephi(gephi, node):
+    """GephiWriter, dict -> NoneType
 
-        Takes a websocket and a node dictionary and adds the node to
-          gephi through a websocket.
+        Takes a GephiWriter and a node dictionary and adds the node to
+          gephi through the writer's websocket.
 
     """
     # Create a copy of the node dictionary
     n = node.copy()   
     
-    name = n.pop("name")
+    nodeID = n.pop("id")
+    n["label"] = n.pop("name")
 
-    # Create the string formatted for the gephi websocket plugin
-    s = json.dumps({"an":{name:n}})
-
-    # Send the node (including attributes)
-    graph_ws.send(s)
+    # Queue the node (including attributes)
+    gephi.add_node(nodeID, n)
 
 
 def import_edge_to_neo(graph_db, edge):
@@ -218,28 +698,21 @@ def import_edge_to_neo(graph_db, edge):
         b = True
 
     # Add attributes
-    r.update_properties(edge)
+    if edge:
+        r.update_properties(edge)
 
     return r, b
 
 
-def import_edge_to_ubigraph(u, edge):
-    """xmlrpc server, dict -> NoneType
+def import_edge_to_ubigraph(ubi, edge):
+    """UbigraphWriter, dict -> NoneType
 
-        Takes an xml rpc server and a edge dictionary and sends
+        Takes a UbigraphWriter and a edge dictionary and sends
          the edge to the ubigraph server.
          
     """
-    # Create a copy of the edge
-    e = edge.copy()
-
-    # Hash the source/target to make an ID for the edge
-    edgeID = jenkins.hashlittle("{0}{1}".format(e["source"], e["target"]))
-    sourceID = jenkins.hashlittle(e.pop("source"))
-    targetID = jenkins.hashlittle(e.pop("target"))
-
-    # Create the node
-    u.new_edge_w_id(edgeID, sourceID, targetID)
+    # Create the edge
+    ubi.new_edge(edge["id"], edge["source"], edge["target"])
 
 
 def import_edge_to_networkx(g, edge):
@@ -252,101 +725,328 @@ def import_edge_to_networkx(g, edge):
     # Create a copy of the edge
     e = edge.copy()
     
+    e.pop("id")
     source = e.pop("source")
     target = e.pop("target")
 
+    # Weight the edge by how often it's traversed
+    if "traversals" in e:
+        e["weight"] = e["traversals"]
+
     # Add the edge with attributes
     g.add_edge(source, target, e)
 
 
-def import_edge_to_gephi(graph_ws, edge):
-    """websocket, dict -> NoneType
+def import_edge_to_gephi(gephi, edge):
+    """GephiWriter, dict -> NoneType
 
-        Takes a websocket and a edge dictionary and adds the edge to
-          gephi through a websocket.
+        Takes a GephiWriter and a edge dictionary and adds the edge to
+          gephi through the writer's websocket.
 
     """
     # Make sure the edge is directional
     edge["directed"] = True
+
+    # Weight the edge by how often it's traversed
+    if "traversals" in edge:
+        edge["weight"] = edge["traversals"]
     
-    # Hash the source/target to make an ID for the edge
-    edgeID = jenkins.hashlittle("{0}{1}".format(edge["source"], edge["target"]))
+    edgeID = edge.pop("id")
 
-    # Create the string formatted for the gephi websocket plugin
-    s = json.dumps({"ae":{edgeID:edge}})
+    # gephi reads node ids as strings
+    edge["source"] = str(edge["source"])
+    edge["target"] = str(edge["target"])
 
-    # Add the edge with attributes
-    graph_ws.send(s)
+    # Queue the edge with attributes
+    gephi.add_edge(edgeID, edge)
+
+
+class Pacer(object):
+    """ Lets nodes and edges through as fast as the graph takes them.
+
+    """
+    paced = False
+
+    def wait(self, when):
+        """float -> NoneType
+
+            Takes the time the event was observed (or None) and returns
+             when it may be sent.
+        """
+        pass
+
+
+class RatePacer(Pacer):
+    """ Token bucket: lets through rate events a second on average, and up
+        to burst at once after idling.
+
+    """
+    paced = True
+
+    def __init__(self, rate=PACE_RATE, burst=PACE_BURST):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = burst
+        self.last = time()
+
+    def wait(self, when):
+        now = time()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            sleep((1 - self.tokens) / self.rate)
+            self.tokens = 0
+            self.last = time()
+        else:
+            self.tokens -= 1
+
+
+class ReplayPacer(Pacer):
+    """ Lets events through with the same spacing as the times they were
+        observed, sped up speed times.  Events without a time go straight
+        through.
+
+    """
+    paced = True
+
+    def __init__(self, speed=REPLAY_SPEED):
+        self.speed = float(speed)
+        self.start = None # (observed time, real time) of the first event
+
+    def wait(self, when):
+        if when is None:
+            return
+        if self.start is None:
+            self.start = (when, time())
+            return
+        delay = self.start[1] + (when - self.start[0]) / self.speed - time()
+        if delay > 0:
+            sleep(delay)
+
+
+def make_pacer(mode):
+    """str -> Pacer
+
+        Takes a PACE mode and returns a new pacer for it.
+    """
+    if mode == "rate":
+        return RatePacer()
+    elif mode == "replay":
+        return ReplayPacer()
+    elif mode == "fast":
+        return Pacer()
+    raise ValueError("Unknown pace {0}".format(mode))
+
+
+class Sink(object):
+    """ Sends nodes and edges to one graph on its own thread, in the order
+        they were queued.  If the graph raises an error the rest of its
+        queue is dropped and the error is raised by close().  If the graph
+        buffers, flush is called whenever the queue is idle for FLUSH_IDLE
+        seconds and before the thread stops.  The pacer set by the graph's
+        PACE decides when each node and edge is sent; a paced graph's queue
+        has no limit so it doesn't hold up the others.
+
+    """
+    def __init__(self, name, add_node, add_edge, size=QUEUE_SIZE, flush=None):
+        self.name = name
+        self.add_node = add_node
+        self.add_edge = add_edge
+        self.flush = flush
+        self.pacer = make_pacer(PACE.get(name, "fast"))
+        if self.pacer.paced:
+            size = 0
+        self.queue = Queue.Queue(size)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                timeout = FLUSH_IDLE if self.flush is not None else None
+                item = self.queue.get(True, timeout)
+            except Queue.Empty:
+                self.flush_buffer()
+                continue
+            try:
+                if item is None:
+                    self.flush_buffer()
+                    return
+                kind, obj, when = item
+                if self.error is None:
+                    self.pacer.wait(when)
+                    if kind == "node":
+                        self.add_node(obj)
+                    else:
+                        self.add_edge(obj)
+            except Exception as e:
+                print "Error sending to {0}: {1}".format(self.name, e)
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def flush_buffer(self):
+        if self.flush is not None and self.error is None:
+            try:
+                self.flush()
+            except Exception as e:
+                print "Error sending to {0}: {1}".format(self.name, e)
+                self.error = e
+
+    def put(self, kind, obj, when=None):
+        """str, dict, float -> NoneType
+
+            Takes "node" or "edge", a node or edge dictionary and optionally
+             when it was observed, and queues it.  Blocks while the queue is
+             full.
+        """
+        self.queue.put((kind, obj, when))
+
+    def close(self):
+        """NoneType -> NoneType
+
+            Waits for everything queued to be sent and stops the thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+class Dispatcher(object):
+    """ Sends every node and edge to each Sink.  Each sink gets its own copy
+        since the import functions change the dictionaries.
+
+    """
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def node(self, node, when=None):
+        for sink in self.sinks:
+            sink.put("node", node.copy(), when)
+
+    def edge(self, edge, when=None):
+        for sink in self.sinks:
+            sink.put("edge", edge.copy(), when)
+
+    def close(self):
+        """NoneType -> NoneType
+
+            Waits for every sink to finish, then raises the first error.
+        """
+        error = None
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+
+# py2neo nodes by node id and the ids of edges already in neo4j this
+#  session.  Only used from the neo4j sink's thread.
+neo_nodes = {}
+neo_edges = set()
+
+
+def neo_add_node(node):
+    """dict -> NoneType
+
+        Takes a node dictionary and adds it to neo4j, remembering the py2neo
+         node for edges.  Nodes already added this session aren't looked up
+         again.
+
+    """
+    n = node.copy()
+    nodeID = n.pop("id")
+    if nodeID in neo_nodes:
+        return
+    neo_nodes[nodeID], b = import_node_to_neo(graph_db, n)
+
+
+def neo_add_edge(edge):
+    """dict -> NoneType
+
+        Takes an edge dictionary of node ids and adds it to neo4j with its
+         attributes.  Edges already added this session are skipped.
+
+    """
+    e = edge.copy()
+    edgeID = e.pop("id")
+    if edgeID in neo_edges:
+        return
+    e["source"] = neo_nodes[e["source"]]
+    e["target"] = neo_nodes[e["target"]]
+    import_edge_to_neo(graph_db, e)
+    neo_edges.add(edgeID)
 
 
 def main():
-    # Node dictionaries should be {"name":text, "class":class}
-    # Edge dictionaries should be {"source":sourceID, "target":TargetID}
+    # Node dictionaries should be {"name":text, "class":class, "id":nodeID}
+    # Edge dictionaries should be {"source":sourceID, "target":TargetID,
+    #  "id":edgeID, "traversals":count, "paths":pathIDs} plus "first_seen"
+    #  and "last_seen" with a TIME_COLUMN
 
     # A little verbosity
     print "Starting attack path import"
     print "---------------------------"
 
 
+    # One set of node and edge ids for every graph
+    registry = Registry()
+
+    # Buffer gephi events into larger messages and ubigraph calls into
+    #  multicalls
+    gephi = GephiWriter(graph_ws)
+    ubi = UbigraphWriter(server)
+
+    # Send each graph its nodes and edges on its own thread
+    dispatcher = Dispatcher([
+        Sink("neo4j", neo_add_node, neo_add_edge),
+        Sink("ubigraph", lambda n: import_node_to_ubigraph(ubi, n),
+                         lambda e: import_edge_to_ubigraph(ubi, e),
+                         flush=ubi.flush),
+        Sink("networkx", lambda n: import_node_to_networkx(g, n),
+                         lambda e: import_edge_to_networkx(g, e)),
+        Sink("gephi", lambda n: import_node_to_gephi(gephi, n),
+                      lambda e: import_edge_to_gephi(gephi, e),
+                      flush=gephi.flush)])
+
     # Make sure we're on the first line
     csvfile.seek(0)
 
-    # Read each line of the csv file
-    for line in lineReader:
-        print "Importing Attack Path {0}".format(line[0])
-
-        # Define the first nodes characteristics
-        name = line[1].split(":")[0]
-        Class = line[1].split(":")[1]
-        node = {"name":name, "Class":Class}
-
-        # Import the first node
-        neoSource, b = import_node_to_neo(graph_db, node)
-        import_node_to_ubigraph(u, node)
-        import_node_to_networkx(g, node)
-        import_node_to_gephi(graph_ws, node)
-
-        # Define the Source for future edges
-        nodeSource = node["name"]
-
-        for i in range(2,len(line)):
-            sleep(sleep1) # slow the process down a bit
-
-            # Define the first nodes characteristics
-            name = line[i].split(":")[0]
-            Class = line[i].split(":")[1]
-            node = {"name":name, "Class":Class}
-
-            # Import the node
-            neoTarget, b = import_node_to_neo(graph_db, node)
-            import_node_to_ubigraph(u, node)
-            import_node_to_networkx(g, node)
-            import_node_to_gephi(graph_ws, node)
-
-            # Define the edges
-            neoEdge = {"source":neoSource, "target":neoTarget}
-            edge = {"source":nodeSource, "target":node["name"]}
-            
-            # Import the edge
-            import_edge_to_neo(graph_db, neoEdge)
-            import_edge_to_ubigraph(u, edge)
-            import_edge_to_networkx(g, edge)
-            import_edge_to_gephi(graph_ws, edge)
-
-            # update the source node for edge imports
-            neoSource = neoTarget
-            nodeSource = node["name"]
-
-        sleep(sleep2) # pause between path imports
+    # Read every path up front so each node and edge is sent once, with
+    #  its totals across every path
+    paths = Paths(registry)
+    paths.load(lineReader)
+    print "Importing {0} attack paths: {1} nodes, {2} edges".format(
+        len(paths.pathIDs), len(registry.names), len(paths.edge))
+
+    for kind, obj, when in paths.events():
+        if kind == "node":
+            dispatcher.node(obj, when)
+        else:
+            dispatcher.edge(obj, when)
+
+    # Wait for every graph to finish
+    dispatcher.close()
 
     print "Attack path import complete"
     print ""
     
 
+    if ANALYZE:
+        print "Analyzing attack paths"
+        started = time()
+        analyze_paths(paths, g)
+        print "Analysis took {0:.1f} seconds".format(time() - started)
+
     # Save the GEXF File from networkx
     print "Saving graph to file"
     nx.write_gexf(g, GEXF_FILE)
-    sleep(sleep2)
     print "Complete"
         
 if __name__ == "__main__":
@@ -30,6 +30,7 @@ from py2neo import neo4j, cypher
 import random
 import time
 import requests
+from traversal import Frontier, crawl, DFS
 
 ## STATIC VARIABLES
 # Warp assumes this link ends with "/data".
@@ -98,10 +99,10 @@ def getNext(nID):
 
 
 def printQueue(queue, l):
-    """ list, int -> NoneType
+    """ Frontier, int -> NoneType
 
-        Takes a queue and an int L.  Prints the length of the queue and
-        the first L items in the queue.  Returns nothing.
+        Takes a frontier and an int L.  Prints the length of the frontier
+        and the next L items in it.  Returns nothing.
 
         This is primarily used as a test payload.
 
@@ -110,15 +111,18 @@ def printQueue(queue, l):
         l = len(queue)
     print "-----{0}".format(len(queue))
     if l > 0:
+        items = list(queue.queue)
+        if queue.order == DFS:
+            items.reverse()
         for i in range(0,l):
-            print queue[i]
+            print items[i]
         time.sleep(2)
 
 
 def printStatus(nid, queue, completed, d):
-    """ int, list, list, int -> NoneType
+    """ int, Frontier, set, int -> NoneType
 
-        Takes the current node ID, queue, list of completed node IDs,
+        Takes the current node ID, frontier, set of completed node IDs,
         and depth.  Prints the information.  Returns nothing.
 
         This is primarily used as a test payload.
@@ -131,65 +135,17 @@ def printStatus(nid, queue, completed, d):
 
 
 def main(seed):
-    # Initialize Queue and completed
-    queue = seed
-    completed = []
-    depth = 0
-    
-    # Crawl Indefinitely
-    while 1:
-        r = random.randrange(0, 101)
-        # if there's nothing in the queue, warp
-        if maxDepth == 0 and len(queue) == 0 and R is not 0:
-            completed = []
-            queue = [warp()]
-        # Else, try a random warp
-        elif maxDepth == 0 and r < R:
-            queue = [warp()]
-
-        # If still nothing in the queue, quit
-        if len(queue) == 0:
-            break
-
-        # Pop the current Node and skip execution if
-        #  it's been visited
-        nID = queue.pop(0)
-        # remove the depth divider
-        while type(nID) == str:
-            if len(queue) == 0:
-                nID = None
-            else:
-                nID = queue.pop(0)
-        if nID == None:
-            continue
-                
-        if nID in completed:
-            continue
-        else:
-            completed.append(nID)
-
-        # find the current depth
-        if maxDepth > 0:
-            i = 0
-            if len(queue) > 0:
-                while type(queue[i]) is not str:
-                    i += 1
-                depth = len(queue[i])
-            
+    # Initialize the frontier; it keeps the completed nodes
+    queue = Frontier(seed, DFS, maxDepth)
+
+    # Crawl Indefinitely (random warps only work if maxDepth isn't set)
+    for nID, depth in crawl(queue, getNext, warp if maxDepth == 0 else None, R):
 
 
 
         ##### DO SOMETHING RIGHT HERE #####
 #        printQueue(queue, 5)
-        printStatus(nID, queue, completed, depth)
-
-
-
-        # choose a child of n to walk to
-        if maxDepth == 0:
-            queue = getNext(nID) + queue
-        elif depth < maxDepth:
-            queue = getNext(nID) + ["-" * (depth + 1)] + queue
+        printStatus(nID, queue, queue.visited, depth)
         
 
 if __name__ == "__main__":
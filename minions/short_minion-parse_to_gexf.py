@@ -32,6 +32,7 @@ import random
 import time
 import requests
 import sys
+from traversal import Frontier, crawl, crawl_levels, BFS
 
 ## STATIC VARIABLES
 # Warp assumes this link ends with "/data".
@@ -60,6 +61,9 @@ seed = [82719]
 maxDepth = 0
 # Number from 0 to 100 indicating the % chance to warp
 R = 0
+# Node IDs to find children of in one query, a level at a time.  Set to 0
+#  to query one node at a time.
+K = 100
 
 
 ## EXECUTION
@@ -106,10 +110,10 @@ def getNext(nID):
 
 
 def printQueue(queue, l):
-    """ list, int -> NoneType
+    """ Frontier, int -> NoneType
 
-        Takes a queue and an int L.  Prints the length of the queue and
-        the first L items in the queue.  Returns nothing.
+        Takes a frontier and an int L.  Prints the length of the frontier
+        and the next L items in it.  Returns nothing.
 
         This is primarily used as a test payload.
 
@@ -118,15 +122,16 @@ def printQueue(queue, l):
         l = len(queue)
     print "-----{0}".format(len(queue))
     if l > 0:
+        items = list(queue.queue)
         for i in range(0,l):
-            print queue[i]
+            print items[i]
         time.sleep(2)
 
 
 def printStatus(nid, queue, completed, d):
-    """ int, list, list, int -> NoneType
+    """ int, Frontier, set, int -> NoneType
 
-        Takes the current node ID, queue, list of completed node IDs,
+        Takes the current node ID, frontier, set of completed node IDs,
         and depth.  Prints the information.  Returns nothing.
 
         This is primarily used as a test payload.
@@ -167,11 +172,23 @@ def addRelationshipAttributes(attr):
     
 
 def addChildrenToNX(nID):
-    """ int, list -> set of ints
+    """ int -> set of ints
 
         Takes a node ID.  Queries the neo4j db for children.
         Parses the children into the networkx graph. Returns
-        a list of children ids.
+        a set of children ids.
+
+    """
+    return addChildrenToNXMany([nID])[nID]
+
+
+def addChildrenToNXMany(nIDs):
+    """ list of ints -> dict
+
+        Takes a list of node IDs.  Queries the neo4j db for the
+        children of all of them at once.  Parses the children into
+        the networkx graph.  Returns a dictionary of each node ID's
+        set of children ids.
 
         Query REturn format:
             [ID of source node int,
@@ -182,20 +199,24 @@ def addChildrenToNX(nID):
 
     """
     # setup
-    children = set()
+    children = dict((nID, set()) for nID in nIDs)
 
 #    # either skip if visited
 #    if nID in complete:
 #        return children
 
-    # create the parent node
-    g.add_node(nID)
-    attr = G.node(nID).get_properties()
-    attr = addNodeAttributes(attr)
-    g.node[nID] = attr
+    # create the parent nodes.  Only seeds and warps aren't already
+    #  in the graph; every other node was added as someone's child.
+    for nID in nIDs:
+        if nID in g:
+            continue
+        g.add_node(nID)
+        attr = G.node(nID).get_properties()
+        attr = addNodeAttributes(attr)
+        g.node[nID] = attr
 
     # get the children
-    query = q.format(nID)
+    query = q.format(",".join(str(nID) for nID in nIDs))
     neoNodes, metadata = cypher.execute(G, query)
 
     # parse them
@@ -219,63 +240,35 @@ def addChildrenToNX(nID):
         g.node[row[4]] = row[3]
         complete.add(row[4])
 
-        # Get children of the node
-        query = q.format(row[4])
-        neo_nodes, metadata = cypher.execute(G, query)
-
-        # Add the child to the set of children
-        children.add(row[4])    
+        # Add the child to the set of its parent's children
+        children[row[0]].add(row[4])    
 
     # return the children
     return children
 
 
 def main(seed):
-    # Initialize Queue and completed
-    queue = seed
-    depth = 0
-    global complete
+    # Initialize the frontier
+    queue = Frontier(seed, BFS, maxDepth)
 
     print "Starting Node Export"
-    # Crawl Indefinitely
-    while depth <= maxDepth:
+    # Crawl Indefinitely (random warps only work if maxDepth isn't set)
+    if K > 0:
+        nodes = crawl_levels(queue, addChildrenToNXMany, K,
+                             warp if maxDepth == 0 else None, R)
+    else:
+        nodes = crawl(queue, addChildrenToNX,
+                      warp if maxDepth == 0 else None, R)
+    for nID, depth in nodes:
 
         # progress bar
         if len(complete) % 10 == 0:
             sys.stdout.write("*")
-        
-        r = random.randrange(0, 101)
-        # if there's nothing in the queue, warp
-        if maxDepth == 0 and len(queue) == 0 and R is not 0:
-            complete = set()
-            queue = [warp()]
-        # Else, try a random warp
-        #  random warp only works if maxDepth isn't set
-        elif maxDepth == 0 and r < R:
-            queue = [warp()]
-
-        # If still nothing in the queue, quit
-        if len(queue) == 0:
-            break
-
-        # Pop the current Node
-        nID = queue.pop(0)
-        # if it's a depth divider, increment depth & continue
-        if type(nID) == str:
-            depth = len(nID)
-            continue
 
 
         ##### DO SOMETHING RIGHT HERE #####
-        children = addChildrenToNX(nID)
 #        printStatus(nID, queue, complete, depth)
 
-        # add children and divider to the queue
-        if maxDepth == 0:
-            queue = queue + list(children)
-        else:
-            queue = queue + ['-' * (depth + 1)] + list(children)
-
     print ""
 
     print "Saving File"
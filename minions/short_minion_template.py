@@ -30,6 +30,7 @@ from py2neo import neo4j, cypher
 import random
 import time
 import requests
+from traversal import Frontier, crawl, crawl_levels, BFS, DFS
 
 ## STATIC VARIABLES
 # Warp assumes this link ends with "/data".
@@ -51,6 +52,9 @@ q = """ START n = node({0})
 seed = [82719]
 # The maximum depth to search.  Set to 0 to search indefinitely
 maxDepth = 0
+# Node IDs to find children of in one query, a level at a time.  Set to 0
+#  to query one node at a time.
+K = 100
 
 
 
@@ -97,11 +101,28 @@ def getNext(nID):
     return enqueue
 
 
+def getNextMany(nIDs):
+    """ list of ints -> dict
+
+        Takes a list of node IDs.  Returns a dictionary of each node ID's
+        list of children node IDs, found with one query.
+
+    """
+
+    # find children of every node at once
+    query = q.format(",".join(str(nID) for nID in nIDs))
+    neoNodes, metadata = cypher.execute(G, query)
+    enqueue = dict((nID, []) for nID in nIDs)
+    for n in neoNodes:
+       enqueue[n[0]._id].append(n[1]._id)
+    return enqueue
+
+
 def printQueue(queue, l):
-    """ list, int -> NoneType
+    """ Frontier, int -> NoneType
 
-        Takes a queue and an int L.  Prints the length of the queue and
-        the first L items in the queue.  Returns nothing.
+        Takes a frontier and an int L.  Prints the length of the frontier
+        and the next L items in it.  Returns nothing.
 
         This is primarily used as a test payload.
 
@@ -110,15 +131,18 @@ def printQueue(queue, l):
         l = len(queue)
     print "-----{0}".format(len(queue))
     if l > 0:
+        items = list(queue.queue)
+        if queue.order == DFS:
+            items.reverse()
         for i in range(0,l):
-            print queue[i]
+            print items[i]
         time.sleep(2)
 
 
 def printStatus(nid, queue, completed, d):
-    """ int, list, list, int -> NoneType
+    """ int, Frontier, set, int -> NoneType
 
-        Takes the current node ID, queue, list of completed node IDs,
+        Takes the current node ID, frontier, set of completed node IDs,
         and depth.  Prints the information.  Returns nothing.
 
         This is primarily used as a test payload.
@@ -131,53 +155,22 @@ def printStatus(nid, queue, completed, d):
 
 
 def main(seed):
-    # Initialize Queue and completed
-    queue = seed
-    completed = []
-    depth = 0
-    
-    # Crawl Indefinitely
-    while depth <= maxDepth:
-        
-        r = random.randrange(0, 101)
-        # if there's nothing in the queue, warp
-        if maxDepth == 0 and len(queue) == 0 and R is not 0:
-            completed = []
-            queue = [warp()]
-        # Else, try a random warp
-        #  random warp only works if maxDepth isn't set
-        elif maxDepth == 0 and r < R:
-            queue = [warp()]
-
-        # If still nothing in the queue, quit
-        if len(queue) == 0:
-            break
-
-        # Pop the current Node
-        nID = queue.pop(0)
-        # if it's a depth divider, increment depth & continue
-        if type(nID) == str:
-            depth = len(nID)
-            continue
-        # if it's a node thats been visited, continue
-        elif nID in completed:
-            continue
-        else:
-            completed.append(nID)
+    # Initialize the frontier; it keeps the completed nodes
+    queue = Frontier(seed, BFS, maxDepth)
+
+    # Crawl Indefinitely (random warps only work if maxDepth isn't set)
+    if K > 0:
+        nodes = crawl_levels(queue, getNextMany, K,
+                             warp if maxDepth == 0 else None, R)
+    else:
+        nodes = crawl(queue, getNext, warp if maxDepth == 0 else None, R)
+    for nID, depth in nodes:
 
 
 
         ##### DO SOMETHING RIGHT HERE #####
 #        printQueue(queue, 5)
-        printStatus(nID, queue, completed, depth)
-
-
-
-        # add children and divider to the queue
-        if maxDepth == 0:
-            queue = queue + getNext(nID)
-        else:
-            queue = queue + ['-' * (depth + 1)] + getNext(nID)
+        printStatus(nID, queue, queue.visited, depth)
         
 
 if __name__ == "__main__":
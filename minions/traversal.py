@@ -0,0 +1,206 @@
+'''
+ AUTHOR: Gabriel Bassett
+ DATE: 08-27-2013
+ DEPENDANCIES: None
+ Copyright 2013 Gabriel Bassett
+
+ LICENSE:
+ This program is free software:  you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 or the LIcense, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public LIcense for more dtails.
+
+ You should have received a copy of the GNU General Public License
+ along with theis program.  If not, see <http://www.gnu.org/licenses/>.
+
+ DESCRIPTION:
+ The frontier and crawl loop shared by the minion templates.  Nodes wait
+  in a deque with their depth, visited nodes are kept in a set, and the
+  crawl can be breadth first or depth first with an optional depth limit.
+  A breadth first crawl can also expand a whole level at a time, asking
+  for the children of K nodes in one query.
+
+'''
+
+
+from collections import deque
+import random
+
+## STATIC VARIABLES
+BFS = "bfs"
+DFS = "dfs"
+K = 100 # node IDs expanded in one query by crawl_levels
+
+
+## EXECUTION
+class Frontier(object):
+    """ Node IDs waiting to be visited, each with its depth.  Breadth first
+        visits them in the order they were added, depth first visits the
+        most recently added first.  Nodes deeper than maxDepth aren't
+        added; set maxDepth to 0 for no limit.
+
+    """
+    def __init__(self, seed=(), order=BFS, maxDepth=0):
+        self.order = order
+        self.maxDepth = maxDepth
+        self.queue = deque()
+        self.visited = set()
+        self.push(seed, 0)
+
+    def __len__(self):
+        return len(self.queue)
+
+    def push(self, nIDs, depth):
+        """ list of ints, int -> NoneType
+
+            Takes node IDs and their depth and adds the ones that haven't
+            been visited.
+
+        """
+        if self.maxDepth and depth > self.maxDepth:
+            return
+        nIDs = [(nID, depth) for nID in nIDs if nID not in self.visited]
+        if self.order == DFS:
+            # so the first child is visited first
+            nIDs.reverse()
+        self.queue.extend(nIDs)
+
+    def pop(self):
+        """ NoneType -> (int, int)
+
+            Takes nothing.  Returns the next unvisited node ID and its
+            depth, marking it visited, or None if there isn't one.
+
+        """
+        while self.queue:
+            if self.order == DFS:
+                nID, depth = self.queue.pop()
+            else:
+                nID, depth = self.queue.popleft()
+            if nID not in self.visited:
+                self.visited.add(nID)
+                return nID, depth
+        return None
+
+    def pop_level(self):
+        """ NoneType -> list of ints, int
+
+            Takes nothing.  Pops every unvisited node ID waiting at the
+            next depth, marking them visited, and returns them and the
+            depth.  Only for breadth first frontiers.
+
+        """
+        level = []
+        depth = None
+        while self.queue:
+            nID, d = self.queue[0]
+            if depth is None:
+                depth = d
+            elif d != depth:
+                break
+            self.queue.popleft()
+            if nID not in self.visited:
+                self.visited.add(nID)
+                level.append(nID)
+        return level, depth
+
+    def jump(self, nID):
+        """ int -> NoneType
+
+            Takes a node ID.  Drops everything waiting and starts again
+            from the node at depth 0.
+
+        """
+        self.queue.clear()
+        self.push([nID], 0)
+
+    def reset(self):
+        """ NoneType -> NoneType
+
+            Forgets everything waiting and visited.
+
+        """
+        self.queue.clear()
+        self.visited.clear()
+
+
+def crawl(frontier, getNext, warp=None, R=0):
+    """ Frontier, function, function, int -> generator of (int, int)
+
+        Takes a frontier, a function that returns a node ID's children, a
+        function that returns a random node ID and the % chance to warp.
+        Yields each node ID and its depth as it's visited, then adds the
+        node's children.
+
+        With warp and R, an empty frontier starts over from a random node
+        and each step has an R% chance of jumping to one.  Otherwise the
+        crawl stops when the frontier is empty.
+
+    """
+    warping = warp is not None and R != 0
+    while True:
+        if warping:
+            # if there's nothing in the frontier, warp
+            if not frontier:
+                frontier.reset()
+                frontier.push([warp()], 0)
+            # Else, try a random warp
+            elif random.randrange(0, 101) < R:
+                frontier.jump(warp())
+
+        item = frontier.pop()
+        if item is None:
+            if warping:
+                continue
+            return
+        nID, depth = item
+
+        yield nID, depth
+
+        frontier.push(getNext(nID), depth + 1)
+
+
+def crawl_levels(frontier, getNextMany, k=K, warp=None, R=0):
+    """ Frontier, function, int, function, int -> generator of (int, int)
+
+        Takes a breadth first frontier, a function that takes a list of
+        node IDs and returns a dict of each one's children, the most node
+        IDs to expand at once, a function that returns a random node ID and
+        the % chance to warp.  Yields every node ID and its depth on a
+        level, then expands the level k nodes at a time.
+
+        With warp and R, an empty frontier starts over from a random node
+        and each level has an R% chance of jumping to one.  Otherwise the
+        crawl stops when the frontier is empty.
+
+    """
+    warping = warp is not None and R != 0
+    while True:
+        if warping:
+            # if there's nothing in the frontier, warp
+            if not frontier:
+                frontier.reset()
+                frontier.push([warp()], 0)
+            # Else, try a random warp
+            elif random.randrange(0, 101) < R:
+                frontier.jump(warp())
+
+        level, depth = frontier.pop_level()
+        if not level:
+            if warping or frontier:
+                continue
+            return
+
+        for nID in level:
+            yield nID, depth
+
+        for i in range(0, len(level), k):
+            chunk = level[i:i + k]
+            children = getNextMany(chunk)
+            for nID in chunk:
+                frontier.push(children.get(nID, ()), depth + 1)